@@ -0,0 +1,218 @@
+import sys
+import time
+import argparse
+
+from bootstrap.lexer import Lexer, Token, TokenType
+from bootstrap.parser import Parser
+
+
+# the per-character scanner bootstrap.lexer used before it moved to a
+# single compiled regex, kept here as the baseline for the comparison
+
+class LegacyLexer:
+    def __init__(self,
+                 text: str):
+        self.text = text
+        self.pos = 0
+        self.line = 1
+        self.col = 1
+        self.current_char = self.text[0] if text else None
+
+
+    def advance(self):
+        self.pos += 1
+        if self.pos >= len(self.text):
+            self.current_char = None
+            return
+
+        self.current_char = self.text[self.pos]
+        if self.current_char == '\n':
+            self.line += 1
+            self.col = 1
+
+            return
+
+        self.col += 1
+
+
+    def skip_whitespace(self):
+        while self.current_char is not None and self.current_char.isspace():
+            self.advance()
+
+
+    def identifier(self):
+        result = ''
+
+        while self.current_char is not None and (self.current_char.isalnum() or self.current_char in '_:@/.-'):
+            result += self.current_char
+            self.advance()
+
+        return result
+
+
+    def string(self):
+        result = ''
+
+        self.advance()
+        while self.current_char is not None and self.current_char != '"':
+            if self.current_char == '\\':
+                self.advance()
+                if self.current_char == 'n':
+                    result += '\n'
+                elif self.current_char == 't':
+                    result += '\t'
+                else:
+                    result += self.current_char
+            else:
+                result += self.current_char
+
+            self.advance()
+
+        self.advance()
+
+        return result
+
+
+    def get_next_token(self):
+        while self.current_char is not None:
+            if self.current_char.isspace():
+                self.skip_whitespace()
+                continue
+
+            if self.current_char.isalpha() or self.current_char in '_@/':
+                return Token(TokenType.IDENTIFIER, self.identifier(), self.line, self.col)
+
+            if self.current_char == '"':
+                return Token(TokenType.STRING, self.string(), self.line, self.col)
+
+            if self.current_char == '=':
+                token = Token(TokenType.EQUALS, '=', self.line, self.col)
+                self.advance()
+
+                return token
+
+            if self.current_char == ',':
+                token = Token(TokenType.COMMA, ',', self.line, self.col)
+                self.advance()
+
+                return token
+
+            if self.current_char == '(':
+                token = Token(TokenType.LPAREN, '(', self.line, self.col)
+                self.advance()
+
+                return token
+
+            if self.current_char == ')':
+                token = Token(TokenType.RPAREN, ')', self.line, self.col)
+                self.advance()
+
+                return token
+
+            if self.current_char == '[':
+                token = Token(TokenType.LBRACKET, '[', self.line, self.col)
+                self.advance()
+
+                return token
+
+            if self.current_char == ']':
+                token = Token(TokenType.RBRACKET, ']', self.line, self.col)
+                self.advance()
+
+                return token
+
+            raise Exception(f"invalid character: {self.current_char} at line {self.line}, column {self.col}")
+
+        return Token(TokenType.EOF, '', self.line, self.col)
+
+
+    def tokenize(self):
+        tokens = []
+
+        token = self.get_next_token()
+        while token.type != TokenType.EOF:
+            tokens.append(token)
+            token = self.get_next_token()
+
+        tokens.append(token)
+
+        return tokens
+
+
+def generate_build_file(size):
+    chunks = []
+    total = 0
+
+    i = 0
+    while total < size:
+        chunk = (f'cc_library(name = "lib_{i}",\n'
+                 f'           sources = glob(pattern = "source/lib_{i}/**/*.cc"),\n'
+                 f'           includes = ["include", "source/lib_{i}/include"],\n'
+                 f'           deps = ["@/third-party/fmt",\n'
+                 f'                   "@/pkg_{i // 10}/lib_{max(0, i - 1)}"])\n'
+                 f'cc_binary(name = "bin_{i}",\n'
+                 f'          sources = ["main_{i}.cc", "escaped\\"name\\t.cc"],\n'
+                 f'          deps = ["@/pkg_{i // 10}/lib_{i}"])\n\n')
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+
+    return "".join(chunks)
+
+
+def _measure(fn,
+             repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "compare lexer throughput on a generated BUILD file")
+    parser.add_argument("--size-mb", type = float, default = 4.0)
+    parser.add_argument("--repeat", type = int, default = 3)
+    args = parser.parse_args(argv)
+
+    text = generate_build_file(int(args.size_mb * 1024 * 1024))
+    size_mb = len(text) / (1024 * 1024)
+
+    legacy_time, legacy_tokens = _measure(lambda: LegacyLexer(text).tokenize(),
+                                          args.repeat)
+    regex_time, regex_tokens = _measure(lambda: Lexer(text).tokenize(),
+                                        args.repeat)
+
+    if legacy_tokens != regex_tokens:
+        print("error: token streams differ")
+        return 1
+
+    def parse_lazily():
+        parser = Parser(Lexer(text).tokens())
+
+        nodes = 0
+        while parser.current_token.type != TokenType.EOF:
+            parser.expr()
+            nodes += 1
+
+        return nodes
+
+    parse_time, _ = _measure(parse_lazily,
+                             args.repeat)
+
+    print(f"input:            {size_mb:.2f} MiB, {len(regex_tokens)} tokens")
+    print(f"legacy lexer:     {legacy_time:.3f}s ({size_mb / legacy_time:.2f} MiB/s)")
+    print(f"regex lexer:      {regex_time:.3f}s ({size_mb / regex_time:.2f} MiB/s)")
+    print(f"speedup:          {legacy_time / regex_time:.1f}x")
+    print(f"lazy lex + parse: {parse_time:.3f}s ({size_mb / parse_time:.2f} MiB/s)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,243 @@
+import os
+import sys
+import random
+import argparse
+
+
+# a stand-in for c++ and ar that only creates the files the build expects,
+# so scheduling can be measured without a real toolchain
+FAKE_TOOL = """#!/bin/sh
+# generated by bench.monorepo, a no-op compiler/archiver
+if [ "$1" = "--version" ]; then
+    echo "xenbuild fake toolchain"
+    exit 0
+fi
+
+case "$(basename "$0")" in
+    ar)
+        : > "$2"
+        exit 0
+        ;;
+esac
+
+out=
+dep=
+src=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) out="$2"; shift ;;
+        -MF) dep="$2"; shift ;;
+        -MT|-MQ|-x|-include|-include-pch|-imacros) shift ;;
+        -*) ;;
+        *) src="$1" ;;
+    esac
+    shift
+done
+
+[ -n "$out" ] && : > "$out"
+[ -n "$dep" ] && echo "$out: $src" > "$dep"
+exit 0
+"""
+
+
+def write_fake_toolchain(bin_dir):
+    # returns the directory to put in front of PATH
+    os.makedirs(bin_dir,
+                exist_ok = True)
+
+    for name in ("c++", "ar"):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as fp:
+            fp.write(FAKE_TOOL)
+
+        os.chmod(path,
+                 0o755)
+
+    return bin_dir
+
+
+def _pick_deps(rng,
+               candidates,
+               dependents,
+               fan_out,
+               fan_in):
+    # up to fan_out earlier targets, none of them taking more than fan_in
+    # dependents; saturated targets are swapped out of the candidate list
+    picks = rng.sample(range(len(candidates)),
+                       min(fan_out, len(candidates)))
+    deps = [candidates[i] for i in picks]
+
+    # highest index first so swapping in the last entry never moves a pick
+    for i in sorted(picks, reverse = True):
+        dependents[candidates[i]] += 1
+        if dependents[candidates[i]] >= fan_in:
+            candidates[i] = candidates[-1]
+            candidates.pop()
+
+    return deps
+
+
+def _target_block(rule,
+                  name,
+                  sources,
+                  deps,
+                  style):
+    indent = " " * (len(rule) + 1)
+
+    if style == "glob":
+        source_expr = f'glob(pattern = "source/{name}/*.cc")'
+    else:
+        source_expr = "[" + f",\n{indent}           ".join(f'"{s}"' for s in sources) + "]"
+
+    lines = [f'{rule}(name = "{name}",',
+             f'{indent}sources = {source_expr},',
+             f'{indent}includes = ["include"],']
+    if deps:
+        lines.append(f'{indent}deps = [' + f",\n{indent}        ".join(f'"{d}"' for d in deps) + "])")
+    else:
+        lines[-1] = lines[-1][:-1] + ")"
+
+    return "\n".join(lines) + "\n"
+
+
+def generate(root,
+             packages = 100,
+             targets = 10,
+             sources = 5,
+             fan_out = 3,
+             fan_in = 20,
+             style = "glob",
+             binaries = 0.1,
+             seed = 0):
+    # writes `packages` directories with `targets` targets each, every
+    # target depending on up to fan_out targets of earlier packages so the
+    # graph stays acyclic; returns a summary of what was generated
+    if style not in ("glob", "literal"):
+        raise ValueError(f"unknown BUILD file style {style}, expected glob or literal")
+
+    rng = random.Random(seed)
+
+    candidates = []
+    dependents = {}
+    edges = 0
+    binary_count = 0
+
+    for p in range(packages):
+        package = f"pkg_{p}"
+        package_dir = os.path.join(root, package)
+        os.makedirs(os.path.join(package_dir, "include"),
+                    exist_ok = True)
+
+        blocks = []
+        labels = []
+        for t in range(targets):
+            # names are unique repo-wide, libraries land in one build/lib
+            name = f"{package}_t{t}"
+            label = f"@/{package}/{name}"
+
+            source_dir = os.path.join(package_dir, "source", name)
+            os.makedirs(source_dir,
+                        exist_ok = True)
+
+            with open(os.path.join(package_dir, "include", f"{name}.hh"), "w") as fp:
+                fp.write(f"#pragma once\nint {name}_f0();\n")
+
+            source_paths = []
+            for s in range(sources):
+                source_path = f"source/{name}/f{s}.cc"
+                source_paths.append(source_path)
+
+                with open(os.path.join(package_dir, source_path), "w") as fp:
+                    fp.write(f'#include "{name}.hh"\nint {name}_f{s}() {{ return {s}; }}\n')
+
+            deps = _pick_deps(rng,
+                              candidates,
+                              dependents,
+                              fan_out,
+                              fan_in)
+            edges += len(deps)
+
+            is_binary = rng.random() < binaries
+            binary_count += is_binary
+
+            blocks.append(_target_block("cc_binary" if is_binary else "cc_library",
+                                        name,
+                                        source_paths,
+                                        deps,
+                                        style))
+            if not is_binary:
+                labels.append(label)
+
+        with open(os.path.join(package_dir, "BUILD"), "w") as fp:
+            fp.write("\n".join(blocks))
+
+        # targets only become candidates once their package is written, so
+        # dependencies always point at earlier packages
+        for label in labels:
+            dependents[label] = 0
+            candidates.append(label)
+
+    return {"packages": packages,
+            "targets": packages * targets,
+            "binaries": binary_count,
+            "sources": packages * targets * sources,
+            "edges": edges,
+            "style": style,
+            "seed": seed}
+
+
+def add_arguments(parser):
+    parser.add_argument("--packages", type = int, default = 100)
+    parser.add_argument("--targets", type = int, default = 10,
+                        help = "targets per package")
+    parser.add_argument("--sources", type = int, default = 5,
+                        help = "source files per target")
+    parser.add_argument("--fan-out", type = int, default = 3,
+                        help = "dependencies per target")
+    parser.add_argument("--fan-in", type = int, default = 20,
+                        help = "maximum number of dependents per library")
+    parser.add_argument("--style", choices = ("glob", "literal"), default = "glob",
+                        help = "list sources through glob() or literally")
+    parser.add_argument("--binaries", type = float, default = 0.1,
+                        help = "fraction of targets that are cc_binary")
+    parser.add_argument("--seed", type = int, default = 0)
+
+
+def generate_from_args(root,
+                       args):
+    return generate(root,
+                    packages = args.packages,
+                    targets = args.targets,
+                    sources = args.sources,
+                    fan_out = args.fan_out,
+                    fan_in = args.fan_in,
+                    style = args.style,
+                    binaries = args.binaries,
+                    seed = args.seed)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "generate a synthetic xenbuild monorepo")
+    parser.add_argument("root")
+    parser.add_argument("--fake-toolchain", action = "store_true",
+                        help = "also write no-op c++ and ar into ROOT/.bin")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.root) and os.listdir(args.root):
+        print(f"error: {args.root} is not empty")
+        return 1
+
+    summary = generate_from_args(args.root,
+                                 args)
+    print(f"[!] generated {summary['targets']} targets in {summary['packages']} packages with {summary['edges']} dependencies under {args.root}")
+
+    if args.fake_toolchain:
+        bin_dir = write_fake_toolchain(os.path.join(args.root, ".bin"))
+        print(f"[!] build with PATH={os.path.abspath(bin_dir)}:$PATH to use the no-op toolchain")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,266 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess as sp
+
+from bootstrap.builder import Builder
+from bootstrap.lexer import Lexer, TokenType
+from bootstrap.parser import Parser
+from bootstrap.trace import Tracer
+
+from bench.monorepo import add_arguments, generate_from_args, write_fake_toolchain
+
+
+# each phase is timed on its own, best of --repeat runs; phases that depend
+# on build/ state run both cold (empty build/) and warm (caches filled).
+# setup runs outside the timer and hands its result to the timed function,
+# so building a Builder (which loads its caches) is never counted
+
+def _best(fn,
+          repeat,
+          setup = None):
+    best = None
+    result = None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def _reset(root):
+    shutil.rmtree(os.path.join(root, "build"),
+                  ignore_errors = True)
+
+
+def _builder(root,
+             jobs):
+    # no action cache, every cold build really runs the (fake) toolchain
+    return Builder(root,
+                   jobs = jobs,
+                   cache_dir = None)
+
+
+def _parse(tokens):
+    parser = Parser(tokens)
+
+    nodes = []
+    while parser.current_token.type != TokenType.EOF:
+        nodes.append(parser.expr())
+
+    return nodes
+
+
+def _evaluate(builder,
+              parsed):
+    ctx = builder.eval_ctx
+    for build_file, nodes in parsed:
+        ctx.current_dir = os.path.dirname(os.path.relpath(build_file, builder.repo_root))
+        ctx.glob_index.begin()
+
+        for node in nodes:
+            builder.evaluator.evaluate(node)
+
+    return len(ctx.targets)
+
+
+def _build(root,
+           jobs):
+    # returns (ok, planning seconds, execution seconds, executed actions)
+    builder = _builder(root,
+                       jobs)
+    dag = builder.build_dependency_graph()
+
+    builder.tracer = Tracer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = builder.build_targets(dag = dag)
+
+    spans = {}
+    actions = 0
+    for event in builder.tracer.events:
+        if event["cat"] == "phase":
+            spans[event["name"]] = event["dur"] / 1e6
+        else:
+            actions += 1
+
+    return ok, spans.get("action planning", 0.0), spans.get("execution", 0.0), actions
+
+
+def _revision():
+    try:
+        result = sp.run(["git", "describe", "--always", "--dirty"],
+                        cwd = os.path.dirname(os.path.abspath(__file__)),
+                        stdout = sp.PIPE,
+                        stderr = sp.DEVNULL)
+    except OSError:
+        return None
+
+    return result.stdout.decode("utf-8").strip() or None
+
+
+def run(root,
+        repeat = 3,
+        jobs = None,
+        build = True):
+    phases = {}
+    counts = {}
+
+    def cold():
+        _reset(root)
+
+    def warm_builder():
+        return _builder(root,
+                        jobs)
+
+    def cold_builder():
+        _reset(root)
+
+        return _builder(root,
+                        jobs)
+
+    # discovery, cold walks every directory, warm revalidates the manifest
+    phases["discover_build_files.cold"], build_files = _best(Builder.discover_build_files,
+                                                             repeat,
+                                                             cold_builder)
+    phases["discover_build_files.warm"], _ = _best(Builder.discover_build_files,
+                                                   repeat,
+                                                   warm_builder)
+    counts["build_files"] = len(build_files)
+
+    contents = []
+    for build_file in build_files:
+        with open(build_file, "r") as fp:
+            contents.append(fp.read())
+    counts["build_file_bytes"] = sum(len(c) for c in contents)
+
+    phases["lexer.tokenize"], tokens = _best(lambda: [Lexer(c).tokenize() for c in contents],
+                                             repeat)
+    counts["tokens"] = sum(len(t) for t in tokens)
+
+    phases["parser"], nodes = _best(lambda: [_parse(t) for t in tokens],
+                                    repeat)
+    parsed = list(zip(build_files, nodes))
+
+    # globs are resolved during evaluation, so the glob index starts cold
+    phases["evaluator.evaluate"], counts["targets"] = _best(lambda builder: _evaluate(builder, parsed),
+                                                            repeat,
+                                                            cold_builder)
+
+    phases["build_dependency_graph.cold"], _ = _best(Builder.build_dependency_graph,
+                                                     repeat,
+                                                     cold_builder)
+    phases["build_dependency_graph.warm"], dag = _best(Builder.build_dependency_graph,
+                                                       repeat,
+                                                       warm_builder)
+    counts["dependencies"] = sum(len(e) for e in dag.edges.values())
+
+    phases["topological_sort"], _ = _best(dag.topological_sort,
+                                          repeat)
+
+    if build:
+        for kind, before in (("cold", cold), ("noop", None)):
+            best = None
+            for _ in range(repeat):
+                if before is not None:
+                    before()
+
+                ok, planning, execution, actions = _build(root,
+                                                          jobs)
+                if not ok:
+                    raise RuntimeError("the synthetic build failed")
+
+                if best is None or planning + execution < sum(best):
+                    best = (planning, execution)
+
+                if kind == "cold":
+                    counts["actions"] = actions
+
+            phases[f"action_planning.{kind}"], phases[f"scheduling.{kind}"] = best
+
+    return phases, counts
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "time each xenbuild phase on a synthetic monorepo")
+    parser.add_argument("--root", default = None,
+                        help = "generate into ROOT and keep it (defaults to a temporary directory)")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("--no-build", action = "store_true",
+                        help = "skip action planning and scheduling")
+    parser.add_argument("--output", default = None,
+                        help = "write the JSON results to OUTPUT instead of stdout")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.root is not None and os.path.exists(args.root) and os.listdir(args.root):
+        print(f"error: {args.root} is not empty")
+        return 1
+
+    root = os.path.abspath(args.root or tempfile.mkdtemp(prefix = "xenbuild-bench-"))
+    cwd = os.getcwd()
+    path = os.environ.get("PATH", "")
+
+    try:
+        config = generate_from_args(root,
+                                    args)
+
+        # actions run relative to the repository root, with the no-op
+        # toolchain shadowing the real one
+        bin_dir = write_fake_toolchain(os.path.join(root, ".bin"))
+        os.environ["PATH"] = bin_dir + os.pathsep + path
+        os.chdir(root)
+
+        phases, counts = run(root,
+                             args.repeat,
+                             args.jobs,
+                             not args.no_build)
+    finally:
+        os.chdir(cwd)
+        os.environ["PATH"] = path
+
+        if args.root is None:
+            shutil.rmtree(root,
+                          ignore_errors = True)
+
+    results = {"revision": _revision(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpus": os.cpu_count(),
+               "jobs": args.jobs or os.cpu_count(),
+               "repeat": args.repeat,
+               "config": config,
+               "counts": counts,
+               "seconds": {name: round(seconds, 6) for name, seconds in phases.items()}}
+
+    if args.output is None:
+        json.dump(results,
+                  sys.stdout,
+                  indent = 2)
+        print()
+    else:
+        with open(args.output, "w") as fp:
+            json.dump(results,
+                      fp,
+                      indent = 2)
+
+        print(f"[!] results written to {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
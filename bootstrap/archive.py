@@ -0,0 +1,66 @@
+import os
+import stat
+import shlex
+import shutil
+
+from .state import hash_bytes
+
+
+ARCHIVE_MODES = ("full", "incremental", "thin")
+
+
+def changed_members(action,
+                    state):
+    # members of action's archive whose objects changed since it was last
+    # written, or None when it has to be created from scratch
+    if not os.path.exists(action.output):
+        return None
+
+    record = state.records.get(action.output)
+    if record is None:
+        return None
+
+    # a different member list or different flags rebuild everything
+    cmd_digest, inputs, output_digest = record
+    if cmd_digest != hash_bytes(action.cmd.encode("utf-8")):
+        return None
+
+    if state.digest(action.output) != output_digest:
+        return None
+
+    # ar addresses members by basename, duplicates can't be replaced
+    names = [os.path.basename(m) for m in action.members]
+    if len(set(names)) != len(names):
+        return None
+
+    recorded = {state.paths[path_id]: digest
+                for path_id, digest in inputs}
+
+    return [m for m in action.members
+            if state.digest(m) != recorded.get(m)]
+
+
+def break_hardlink(path):
+    # the archive may share its inode with an action cache blob and ar
+    # updates archives in place, so it gets a private writable copy first
+    st = os.stat(path)
+    if st.st_nlink <= 1 and st.st_mode & stat.S_IWUSR:
+        return
+
+    tmp_path = f"{path}.unlink"
+    shutil.copyfile(path,
+                    tmp_path)
+    os.chmod(tmp_path,
+             stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+    os.replace(tmp_path,
+               path)
+
+
+def update_command(action,
+                   members):
+    # the archive command with only the given members, e.g.
+    # `ar rcs out.a a.o b.o` -> `ar rcs out.a b.o`
+    argv = shlex.split(action.cmd)
+    prefix = argv[:argv.index(action.output) + 1]
+
+    return shlex.join(prefix + members)
@@ -0,0 +1,77 @@
+import os
+import pickle
+
+from .state import hash_bytes
+from .fsutil import atomic_write
+
+
+AST_CACHE_VERSION = 1
+
+
+class ASTCache:
+    def __init__(self,
+                 path):
+        self.path = path
+
+        # BUILD file path -> (mtime_ns, size, content digest, nodes)
+        self.entries = {}
+        self.dirty = False
+
+        self.load()
+
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as fp:
+                version, entries = pickle.load(fp)
+
+            if version != AST_CACHE_VERSION:
+                raise ValueError(f"unsupported AST cache version {version}")
+
+            self.entries = entries
+        except Exception:
+            self.entries = {}
+
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        atomic_write(self.path,
+                     pickle.dumps((AST_CACHE_VERSION, self.entries),
+                                  protocol = pickle.HIGHEST_PROTOCOL))
+        self.dirty = False
+
+
+    def get(self,
+            build_filepath,
+            parse):
+        st = os.stat(build_filepath)
+
+        entry = self.entries.get(build_filepath)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[3]
+
+        with open(build_filepath, "r") as fp:
+            content = fp.read()
+
+        digest = hash_bytes(content.encode("utf-8"))
+        if entry is not None and entry[2] == digest:
+            nodes = entry[3]
+        else:
+            nodes = parse(content)
+
+        self.entries[build_filepath] = (st.st_mtime_ns, st.st_size, digest, nodes)
+        self.dirty = True
+
+        return nodes
+
+
+    def prune(self,
+              build_files):
+        live = set(build_files)
+
+        for path in list(self.entries):
+            if path not in live:
+                del self.entries[path]
+                self.dirty = True
@@ -4,33 +4,107 @@ from .dag import DAG
 from .lexer import Lexer, Token, TokenType
 from .parser import Parser
 from .evaluator import Evaluator, EvaluationContext
+from .scheduler import Action, Scheduler
+from .state import BuildState
+from .astcache import ASTCache
+from .discovery import BuildFileFinder
+from .pkgconfig import PkgConfig, PkgConfigError
+from .globindex import GlobIndex
+from .trace import Tracer
+from .cache import ActionCache
+from .remote import RemoteCache
+from .distributed import WorkerPool
+from .unity import write_include_file
+from .archive import ARCHIVE_MODES
 from .ast import ASTNode, String, List, Variable, RuleCall, Target
 
 
 class Builder:
     def __init__(self,
                  repo_root,
-                 debug = True):
+                 debug = True,
+                 jobs = None,
+                 cache_dir = None,
+                 cache_size = 10 << 30,
+                 remote_cache = None,
+                 discovery_manifest = True,
+                 keep_going = False,
+                 workers = None,
+                 unity = 0,
+                 archive = "full"):
         self.repo_root = os.path.abspath(repo_root)
-
+        self.jobs = jobs or os.cpu_count() or 1
+        self.keep_going = keep_going
+
+        if archive not in ARCHIVE_MODES:
+            raise ValueError(f"unknown archive mode {archive}, expected one of {', '.join(ARCHIVE_MODES)}")
+
+        # incremental and thin archives replace only the changed members
+        self.archive = archive
+
+        # compile actions are offloaded to these when given, links and
+        # anything the workers can't take run locally
+        self.workers = WorkerPool(workers) if workers else None
+
+        self.cache = None
+        if cache_dir is not None:
+            remote = None
+            if remote_cache is not None:
+                remote = RemoteCache(remote_cache)
+
+            self.cache = ActionCache(cache_dir,
+                                     cache_size,
+                                     remote)
+
+        pkgconfig = PkgConfig(os.path.join(self.repo_root,
+                                           "build",
+                                           "pkgconfig.cache"))
+        glob_index = GlobIndex(self.repo_root,
+                               os.path.join(self.repo_root,
+                                            "build",
+                                            "glob_index.cache"))
         self.eval_ctx = EvaluationContext(self.repo_root,
-                                          debug)
+                                          debug,
+                                          pkgconfig,
+                                          glob_index,
+                                          unity,
+                                          archive == "thin")
         self.evaluator = Evaluator(self.eval_ctx)
 
+        self.state = None
+        self.ast_cache = ASTCache(os.path.join(self.repo_root,
+                                               "build",
+                                               "ast_cache.pickle"))
+
+        manifest_path = None
+        if discovery_manifest:
+            manifest_path = os.path.join(self.repo_root,
+                                         "build",
+                                         "build_files.cache")
+        self.finder = BuildFileFinder(self.repo_root,
+                                      manifest_path = manifest_path)
+
+        # replaced by an enabled tracer for builds run with --trace
+        self.tracer = Tracer(enabled = False)
+
 
     def parse_build_file(self,
                          build_filepath):
-        with open(build_filepath, "r") as fp:
-            content = fp.read()
-
         rel_dir = os.path.dirname(os.path.relpath(build_filepath,
                                                   self.repo_root))
         self.eval_ctx.current_dir = rel_dir
+        self.eval_ctx.glob_index.begin()
+
+        with self.tracer.span(f"parse {rel_dir or '.'}/BUILD",
+                              "parse"):
+            return self.ast_cache.get(build_filepath,
+                                      self._parse)
 
-        lexer = Lexer(content)
-        tokens = lexer.tokenize()
 
-        parser = Parser(tokens)
+    def _parse(self,
+               content):
+        lexer = Lexer(content)
+        parser = Parser(lexer.tokens())
 
         nodes = []
         while parser.current_token.type != TokenType.EOF:
@@ -44,22 +118,63 @@ class Builder:
         targets = []
 
         nodes = self.parse_build_file(build_filepath)
-        for node in nodes:
-            result = self.evaluator.evaluate(node)
-            if isinstance(result, Target):
-                targets.append(result)
+        with self.tracer.span(f"evaluate {self.eval_ctx.current_dir or '.'}/BUILD",
+                              "evaluate"):
+            for node in nodes:
+                result = self.evaluator.evaluate(node)
+                if isinstance(result, Target):
+                    targets.append(result)
 
         return targets
 
 
     def discover_build_files(self):
-        build_files = []
-        for root, _, files in os.walk(self.repo_root):
-            for file in files:
-                if file == "BUILD":
-                    build_files.append(os.path.join(root, file))
+        with self.tracer.span("discovery"):
+            return self.finder.find()
+
+
+    def package_build_file(self,
+                           label):
+        # labels are @/<dir>/<name>, the package is the BUILD file in <dir>
+        if not label.startswith("@/"):
+            raise ValueError(f"malformed target label: {label}")
+
+        package_dir = label[2:].rpartition("/")[0]
+
+        return os.path.join(self.repo_root,
+                            package_dir,
+                            "BUILD")
+
+
+    def load_packages(self,
+                      target_names):
+        # evaluates only the packages reachable from target_names through
+        # deps, targets that stay undefined are reported by the caller
+        loaded = set()
+        pending = list(target_names)
+        seen = set(pending)
+
+        while pending:
+            label = pending.pop()
+
+            if label not in self.eval_ctx.targets:
+                build_file = self.package_build_file(label)
+                if build_file not in loaded and os.path.isfile(build_file):
+                    loaded.add(build_file)
+                    self.evaluate_build_file(build_file)
+
+            target = self.eval_ctx.targets.get(label)
+            if target is None:
+                continue
+
+            for dep in target.props["deps"]:
+                if dep not in seen:
+                    seen.add(dep)
+                    pending.append(dep)
 
-        return build_files
+        self.save_caches()
+
+        return self.graph_from_targets()
 
 
     def build_dependency_graph(self):
@@ -67,51 +182,227 @@ class Builder:
         for build_file in build_files:
             self.evaluate_build_file(build_file)
 
+        self.ast_cache.prune(build_files)
+        self.save_caches()
+
+        return self.graph_from_targets()
+
+
+    def save_caches(self):
+        self.ast_cache.save()
+        self.eval_ctx.glob_index.save()
+
+
+    def graph_from_targets(self):
+        with self.tracer.span("pkg-config"):
+            self.eval_ctx.resolve_system_libraries()
+
+        with self.tracer.span("dag construction"):
+            return self._graph_from_targets()
+
+
+    def _graph_from_targets(self):
         graph = DAG()
 
         for target_name, target in self.eval_ctx.targets.items():
             graph.add_node(target_name, target)
 
+        edges = []
         for target_name, target in self.eval_ctx.targets.items():
             for dep_name in target.props["deps"]:
                 if dep_name not in self.eval_ctx.targets:
                     print(f"WARNING: target {target_name} depends on undefined target {dep_name}")
                     continue
 
-                graph.add_edge(dep_name, target_name)
+                edges.append((dep_name, target_name))
+
+        graph.add_edges(edges)
 
         return graph
 
 
     def build_target(self,
                      target_name):
-        dag = self.build_dependency_graph()
-
-        if target_name not in self.eval_ctx.targets:
-            raise ValueError(f"unknown target: {target_name}")
+        return self.build_targets([target_name])
+
+
+    def build_targets(self,
+                      target_names = None,
+                      dag = None):
+        if dag is None:
+            try:
+                if target_names is None:
+                    dag = self.build_dependency_graph()
+                else:
+                    dag = self.load_packages(target_names)
+            except PkgConfigError as err:
+                print(f"error: {err}")
+                return False
 
         try:
-            build_order = dag.topological_sort()
+            with self.tracer.span("topological sort"):
+                dag.topological_sort()
         except ValueError as err:
             print(f"error: {err}")
-            return
+            return False
+
+        return self._execute_plan(dag,
+                                  self.required_targets(dag,
+                                                        target_names))
+
+
+    def required_targets(self,
+                         dag,
+                         target_names = None):
+        if target_names is None:
+            return set(dag.nodes)
+
+        required = set()
+        for target_name in target_names:
+            if target_name not in self.eval_ctx.targets:
+                raise ValueError(f"unknown target: {target_name}")
+
+            if target_name not in required:
+                self._collect_dependencies(dag,
+                                           target_name,
+                                           required)
 
-        target_offset = build_order.index(target_name) + 1
-        build_order = build_order[:target_offset]
+        return required
 
-        target_and_deps = set()
-        self._collect_dependencies(dag,
-                                   target_name,
-                                   target_and_deps)
 
-        filtered_build_order = [t for t in build_order
-                                if t in target_and_deps]
+    def _execute_plan(self,
+                      dag,
+                      target_and_deps):
+        state = self.build_state()
+        state.begin()
 
-        built_deps = []
-        for t in filtered_build_order:
-            self._build_single_target(self.eval_ctx.targets[t],
-                                      built_deps)
-            built_deps.append(self.eval_ctx.targets[t])
+        with self.tracer.span("action planning"):
+            actions = DAG()
+            for t in target_and_deps:
+                self._build_single_target(self.eval_ctx.targets[t],
+                                          actions)
+
+            for t in target_and_deps:
+                link_id = ("link", t)
+                if link_id not in actions.nodes:
+                    continue
+
+                for dep in self.eval_ctx.targets[t].props["deps"]:
+                    # mirrors an edge of the already validated target graph
+                    if ("link", dep) in actions.nodes:
+                        actions.add_edge(("link", dep),
+                                         link_id,
+                                         check_cycles = False)
+
+            self._prioritize(dag,
+                             target_and_deps,
+                             actions,
+                             state)
+
+        scheduler = Scheduler(self.jobs,
+                              state,
+                              self.cache,
+                              self.tracer,
+                              self.keep_going,
+                              self.workers)
+
+        try:
+            with self.tracer.span("execution"):
+                return scheduler.run(actions)
+        finally:
+            state.save()
+
+            if self.cache is not None:
+                self.cache.flush()
+                self.cache.trim()
+
+
+    def build_state(self):
+        # kept for the lifetime of the builder so a long-running server
+        # doesn't reload the database for every build
+        if self.state is None:
+            self.state = BuildState(os.path.join(self.repo_root,
+                                                 "build",
+                                                 "xenbuild.db"))
+
+        return self.state
+
+
+    def _prioritize(self,
+                    dag,
+                    target_and_deps,
+                    actions,
+                    state):
+        mean = state.mean_duration()
+
+        if mean is None:
+            weights = {t: len(self.eval_ctx.targets[t].props["in"])
+                       for t in target_and_deps}
+        else:
+            weights = self.target_durations(target_and_deps,
+                                            state,
+                                            mean)
+
+        priorities = dag.longest_paths(weights)
+        for action in actions.nodes.values():
+            action.priority = priorities[action.target]
+
+
+    def target_durations(self,
+                         target_names,
+                         state,
+                         default = 0):
+        # seconds each target's actions took when they last ran, objects
+        # that never ran count as `default`
+        result = {}
+        for t in target_names:
+            props = self.eval_ctx.targets[t].props
+
+            weight = 0
+            for output in props["obj"] + [props["out"]]:
+                if output in state.durations:
+                    weight += state.durations[output]
+                elif output in props["obj"]:
+                    weight += default
+
+            result[t] = weight
+
+        return result
+
+
+    def owning_targets(self,
+                       paths):
+        # targets affected by changes to the given files: the ones compiling
+        # them, the ones whose objects included them last time, and every
+        # target of a changed BUILD file
+        paths = {os.path.normpath(os.path.relpath(os.path.abspath(p), self.repo_root))
+                 for p in paths}
+
+        headers = self.build_state().headers
+        including = set()
+        for obj, ids in headers.objects.items():
+            if any(headers.paths[i] in paths for i in ids):
+                including.add(os.path.normpath(obj))
+
+        result = set()
+        for name, target in self.eval_ctx.targets.items():
+            package = os.path.normpath(os.path.join(name[2:].rpartition("/")[0], "BUILD"))
+            if package in paths:
+                result.add(name)
+                continue
+
+            sources = list(target.props["in"])
+            for members in target.props.get("unity", {}).values():
+                sources.extend(members)
+
+            if any(os.path.normpath(f) in paths for f in sources):
+                result.add(name)
+                continue
+
+            if any(os.path.normpath(obj) in including for obj in target.props["obj"]):
+                result.add(name)
+
+        return result
 
 
     def _collect_dependencies(self,
@@ -128,11 +419,11 @@ class Builder:
 
     def _build_single_target(self,
                              target,
-                             built_deps):
+                             actions):
         if len(target.props["build"]) <= 0:
             return
 
-        print(f"[+] building {target.props['name']} ...")
+        name = target.props["name"]
 
         os.makedirs(os.path.dirname(target.props["out"]),
                     exist_ok = True)
@@ -140,13 +431,109 @@ class Builder:
             os.makedirs(os.path.dirname(obj),
                         exist_ok = True)
 
+        for unity_file, members in target.props.get("unity", {}).items():
+            write_include_file(unity_file,
+                               members)
+
+        args = self.target_args(target)
+
+        pch = target.props.get("pch")
+        if pch is not None:
+            os.makedirs(os.path.dirname(pch["stub"]),
+                        exist_ok = True)
+            write_include_file(pch["stub"],
+                               [pch["header"]])
+
+            pch_cmd = pch["build"]
+            pch_cmd = pch_cmd.replace("@IN@", pch["stub"])
+            pch_cmd = pch_cmd.replace("@OUT@", pch["out"])
+            pch_cmd = pch_cmd.replace("@DEP@", pch["dep"])
+            pch_cmd = pch_cmd.replace("@ARGS@", ' '.join(args))
+
+            actions.add_node(("pch", name),
+                             Action("pch",
+                                    name,
+                                    pch_cmd,
+                                    [pch["stub"]],
+                                    pch["out"],
+                                    pch["dep"]))
+
+        link_inputs = list(target.props["obj"])
+        for dep_name in target.props["deps"]:
+            dep = self.eval_ctx.targets.get(dep_name)
+            if dep is not None and dep.props["out"]:
+                link_inputs.append(dep.props["out"])
+
+                # a thin archive only names its members, its bytes often
+                # stay the same when their code changes
+                if self.archive == "thin":
+                    link_inputs.extend(dep.props["obj"])
+
+        link_cmd = target.props["link"]
+        link_cmd = link_cmd.replace("@OBJ@",
+                                    " ".join(target.props["obj"]))
+        link_cmd = link_cmd.replace("@OUT@",
+                                    target.props["out"])
+        link_cmd = link_cmd.replace("@ARGS@", ' '.join(args))
+
+        link_action = Action("link",
+                             name,
+                             link_cmd,
+                             link_inputs,
+                             target.props["out"])
+        if self.archive != "full" and link_cmd.split(maxsplit = 1)[0] == "ar":
+            link_action.members = list(target.props["obj"])
+
+        link_id = ("link", name)
+        actions.add_node(link_id,
+                         link_action)
+
+        for i in range(len(target.props["obj"])):
+            in_file = target.props["in"][i]
+            obj = target.props["obj"][i]
+            dep_file = target.props["dep"][i]
+
+            cmd = self.compile_command(target,
+                                       in_file,
+                                       obj,
+                                       dep_file,
+                                       args)
+
+            # depfiles never mention the precompiled header, it is an
+            # explicit input instead
+            inputs = [in_file]
+            if pch is not None:
+                inputs.append(pch["out"])
+
+            compile_id = ("compile", obj)
+            actions.add_node(compile_id,
+                             Action("compile",
+                                    name,
+                                    cmd,
+                                    inputs,
+                                    obj,
+                                    dep_file))
+            actions.add_edge(compile_id,
+                             link_id,
+                             check_cycles = False)
+
+            if pch is not None:
+                actions.add_edge(("pch", name),
+                                 compile_id,
+                                 check_cycles = False)
+
+
+    def target_args(self,
+                    target):
+        # what @ARGS@ expands to in the target's build and link templates
         args = ["-std=c++20",
                 "-Wall",
                 "-Wextra",
                 "-Wno-unused-command-line-argument",
                 "-L./build/lib"]
-        for dep in built_deps:
-            if dep.props["name"] not in target.props["deps"]:
+        for dep_name in target.props["deps"]:
+            dep = self.eval_ctx.targets.get(dep_name)
+            if dep is None:
                 continue
 
             for inc_flag in dep.props["include_flags"]:
@@ -155,30 +542,54 @@ class Builder:
             for link_flag in dep.props["link_flags"]:
                 args.append(link_flag)
 
-        build_cmds = []
-        for i in range(len(target.props["obj"])):
-            in_file = target.props["in"][i]
-            obj = target.props["obj"][i]
+        return args
 
-            cmd = target.props["build"]
-            cmd = cmd.replace("@IN@", in_file)
-            cmd = cmd.replace("@OBJ@", obj)
-            cmd = cmd.replace("@ARGS@", ' '.join(args))
 
-            build_cmds.append(cmd)
+    def compile_command(self,
+                        target,
+                        in_file,
+                        obj,
+                        dep_file,
+                        args):
+        cmd = target.props["build"]
+        cmd = cmd.replace("@IN@", in_file)
+        cmd = cmd.replace("@OBJ@", obj)
+        cmd = cmd.replace("@DEP@", dep_file)
+        cmd = cmd.replace("@ARGS@", ' '.join(args))
 
-        link_cmd = target.props["link"]
-        link_cmd = link_cmd.replace("@OBJ@",
-                                    " ".join(target.props["obj"]))
-        link_cmd = link_cmd.replace("@OUT@",
-                                    target.props["out"])
-        link_cmd = link_cmd.replace("@ARGS@", ' '.join(args))
+        return cmd
 
-        for build_cmd in build_cmds:
-            print(f"\t~> executing: {build_cmd}")
-            os.system(build_cmd)
 
-        print(f"\t~> executing: {link_cmd}")
-        os.system(link_cmd)
+    def compile_commands(self,
+                         target_names):
+        # yields compile_commands.json entries without touching the disk
+        for target_name in target_names:
+            target = self.eval_ctx.targets[target_name]
+            if len(target.props["build"]) <= 0:
+                continue
 
-        print(f"\n[!] done building {target.props['name']}\n")
+            # editors look up the real sources, not the generated unity files
+            sources = target.props.get("unity_sources")
+            if not sources:
+                sources = zip(target.props["in"],
+                              target.props["obj"],
+                              target.props["dep"])
+
+            args = self.target_args(target)
+            pch = target.props.get("pch")
+            for in_file, obj, dep_file in sources:
+                cmd = self.compile_command(target,
+                                           in_file,
+                                           obj,
+                                           dep_file,
+                                           args)
+
+                # the stub and the precompiled header only exist after a
+                # build, the header itself is included instead
+                if pch is not None:
+                    cmd = cmd.replace(pch["flags"], f"-include {pch['header']}")
+
+                yield {"directory": self.repo_root,
+                       "command": cmd,
+                       "file": in_file,
+                       "output": obj}
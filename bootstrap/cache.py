@@ -0,0 +1,404 @@
+import os
+import time
+import fcntl
+import queue
+import shutil
+import marshal
+import tempfile
+import threading
+
+from .depfile import parse_depfile
+from .fsutil import atomic_write
+from .state import hash_bytes, hash_file
+
+
+# linux ioctl that shares the extents of one file with another (reflink)
+FICLONE = 0x40049409
+
+MANIFEST_ENTRIES = 16
+
+
+def default_cache_dir():
+    if "XENBUILD_CACHE_DIR" in os.environ:
+        return os.environ["XENBUILD_CACHE_DIR"]
+
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(cache_home, "xenbuild")
+
+
+def parse_size(text):
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+    text = text.strip().lower().rstrip("ib").rstrip("b")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+
+    return int(text)
+
+
+class ActionCache:
+    def __init__(self,
+                 directory,
+                 max_size = 10 << 30,
+                 remote = None):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.stored = 0
+
+        self.remote = remote
+        self.uploads = queue.Queue()
+        self.uploader = None
+
+
+    def _blob_path(self,
+                   digest):
+        name = digest.hex()
+        return os.path.join(self.directory, "cas", name[:2], name)
+
+
+    def _manifest_path(self,
+                       key):
+        name = key.hex()
+        return os.path.join(self.directory, "ac", name[:2], name)
+
+
+    def action_key(self,
+                   action,
+                   state):
+        # the expanded command already names every input and output path,
+        # so the key only has to add the contents of the direct inputs
+        parts = [b"xenbuild-action-1",
+                 action.cmd.encode("utf-8")]
+
+        for path in action.inputs:
+            digest = state.digest(path)
+            if digest is None:
+                return None
+
+            parts.append(digest)
+
+        return hash_bytes(b"\0".join(parts))
+
+
+    def restore(self,
+                action,
+                state):
+        key = self.action_key(action,
+                              state)
+        if key is None:
+            return False
+
+        entry = self._match(self._load_manifest(key),
+                            state)
+        if entry is None and self.remote is not None:
+            entry = self._match(self.remote.get_manifest(key),
+                                state)
+
+            if entry is not None and self._fetch(entry):
+                self._add_to_manifest(key,
+                                      entry)
+            else:
+                entry = None
+
+        if entry is None:
+            return False
+
+        _, output_blob, depfile_blob = entry
+        try:
+            self._materialize(output_blob,
+                              action.output)
+            if depfile_blob is not None:
+                self._materialize(depfile_blob,
+                                  action.depfile)
+        except OSError:
+            return False
+
+        return True
+
+
+    def _match(self,
+               manifest,
+               state):
+        for entry in manifest:
+            if all(state.digest(path) == digest
+                   for path, digest in entry[0]):
+                return entry
+
+        return None
+
+
+    def _fetch(self,
+               entry):
+        for digest in entry[1:]:
+            if digest is None:
+                continue
+
+            blob = self._blob_path(digest)
+            if os.path.exists(blob):
+                continue
+
+            os.makedirs(os.path.dirname(blob),
+                        exist_ok = True)
+
+            try:
+                if not self.remote.download_blob(digest,
+                                                 blob):
+                    return False
+
+                if hash_file(blob) != digest:
+                    os.unlink(blob)
+                    return False
+
+                os.chmod(blob, 0o555)
+            except OSError:
+                return False
+
+            self.stored += os.path.getsize(blob)
+
+        return True
+
+
+    def store(self,
+              action,
+              state):
+        key = self.action_key(action,
+                              state)
+        if key is None:
+            return
+
+        headers = []
+        if action.depfile is not None:
+            source = os.path.normpath(action.inputs[0])
+
+            try:
+                prerequisites = parse_depfile(action.depfile)
+            except OSError:
+                return
+
+            for path in sorted({os.path.normpath(p) for p in prerequisites} - {source}):
+                digest = state.digest(path)
+                if digest is None:
+                    return
+
+                headers.append((path, digest))
+
+        try:
+            output_blob = self._put_blob(action.output)
+            depfile_blob = None
+            if action.depfile is not None:
+                depfile_blob = self._put_blob(action.depfile)
+        except OSError:
+            return
+
+        entry = (tuple(headers), output_blob, depfile_blob)
+        manifest = self._add_to_manifest(key,
+                                         entry)
+
+        if self.remote is not None and not self.remote.failed:
+            self._start_uploader()
+            self.uploads.put((key, manifest))
+
+
+    def _add_to_manifest(self,
+                         key,
+                         entry):
+        manifest = [e
+                    for e in self._load_manifest(key)
+                    if e[0] != entry[0]]
+        manifest.insert(0, entry)
+        manifest = manifest[:MANIFEST_ENTRIES]
+
+        atomic_write(self._manifest_path(key),
+                     marshal.dumps(manifest))
+
+        return manifest
+
+
+    def _start_uploader(self):
+        if self.uploader is not None:
+            return
+
+        self.uploader = threading.Thread(target = self._upload_loop,
+                                         name = "xenbuild-uploader",
+                                         daemon = True)
+        self.uploader.start()
+
+
+    def _upload_loop(self):
+        while True:
+            batch = [self.uploads.get()]
+            while True:
+                try:
+                    batch.append(self.uploads.get_nowait())
+                except queue.Empty:
+                    break
+
+            # the thread has to outlive any error, flush() waits on the queue
+            try:
+                self._upload(batch)
+            except Exception as err:
+                self.remote._fail(err)
+            finally:
+                for _ in batch:
+                    self.uploads.task_done()
+
+
+    def _upload(self,
+                batch):
+        if self.remote.failed:
+            return
+
+        blobs = {digest
+                 for _, manifest in batch
+                 for _, output_blob, depfile_blob in manifest
+                 for digest in (output_blob, depfile_blob)
+                 if digest is not None and os.path.exists(self._blob_path(digest))}
+
+        for digest in self.remote.find_missing(blobs):
+            if not self.remote.upload_blob(digest,
+                                           self._blob_path(digest)):
+                return
+
+        for key, manifest in batch:
+            manifest = [entry
+                        for entry in manifest
+                        if os.path.exists(self._blob_path(entry[1]))]
+            if not self.remote.put_manifest(key,
+                                            manifest):
+                return
+
+
+    def flush(self):
+        if self.uploader is not None:
+            self.uploads.join()
+
+
+    def _load_manifest(self,
+                       key):
+        path = self._manifest_path(key)
+
+        try:
+            with open(path, "rb") as fp:
+                manifest = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return []
+
+        self._touch(path)
+
+        return manifest
+
+
+    def _put_blob(self,
+                  path):
+        digest = hash_file(path)
+        blob = self._blob_path(digest)
+
+        if os.path.exists(blob):
+            self._touch(blob)
+            return digest
+
+        os.makedirs(os.path.dirname(blob),
+                    exist_ok = True)
+
+        fd, tmp_path = tempfile.mkstemp(prefix = ".blob-",
+                                        dir = os.path.dirname(blob))
+        os.close(fd)
+        try:
+            _clone(path,
+                   tmp_path)
+            os.chmod(tmp_path,
+                     os.stat(path).st_mode & 0o555)
+            os.replace(tmp_path,
+                       blob)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self.stored += os.path.getsize(blob)
+
+        return digest
+
+
+    def _materialize(self,
+                     digest,
+                     dest):
+        # a reflink where the filesystem has them, a copy otherwise. never a
+        # hardlink, outputs edited in place (ar) would corrupt the blob
+        blob = self._blob_path(digest)
+
+        os.makedirs(os.path.dirname(dest) or ".",
+                    exist_ok = True)
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        _clone(blob,
+               dest)
+        os.chmod(dest,
+                 os.stat(blob).st_mode & 0o777 | 0o200)
+
+        self._touch(blob)
+
+
+    def _touch(self,
+               path):
+        # the access time drives eviction, mtime is left alone
+        try:
+            st = os.stat(path)
+            os.utime(path,
+                     ns = (time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+
+
+    def trim(self):
+        if self.stored <= 0:
+            return
+
+        self.stored = 0
+
+        entries = []
+        total = 0
+        for sub in ("cas", "ac"):
+            for root, _, files in os.walk(os.path.join(self.directory, sub)):
+                for name in files:
+                    path = os.path.join(root, name)
+
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+
+                    entries.append((st.st_atime_ns, st.st_size, path))
+                    total += st.st_size
+
+        if total <= self.max_size:
+            return
+
+        # evict down to 90% of the cap so the next build doesn't trim again
+        target = self.max_size * 9 // 10
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def _clone(src,
+           dest):
+    with open(src, "rb") as src_fp, open(dest, "wb") as dest_fp:
+        try:
+            fcntl.ioctl(dest_fp.fileno(), FICLONE, src_fp.fileno())
+            return
+        except OSError:
+            pass
+
+        shutil.copyfileobj(src_fp,
+                           dest_fp,
+                           1 << 20)
@@ -0,0 +1,174 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .state import hash_file
+
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _resolve(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in ("cas", "ac") or not _DIGEST_RE.match(parts[1]):
+            return None, None
+
+        return parts[0], os.path.join(self.server.directory,
+                                      parts[0],
+                                      parts[1][:2],
+                                      parts[1])
+
+
+    def _reply(self,
+               status,
+               body = b"",
+               content_type = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+
+    def _read_body(self,
+                   fp):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise ConnectionError("client closed the connection mid-upload")
+
+            fp.write(chunk)
+            remaining -= len(chunk)
+
+
+    def do_GET(self):
+        kind, path = self._resolve()
+        if path is None:
+            return self._reply(400, b"bad path")
+
+        try:
+            fp = open(path, "rb")
+        except OSError:
+            return self._reply(404, b"not found")
+
+        with fp:
+            size = os.fstat(fp.fileno()).st_size
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+
+            while True:
+                chunk = fp.read(1 << 20)
+                if not chunk:
+                    break
+
+                self.wfile.write(chunk)
+
+
+    def do_HEAD(self):
+        kind, path = self._resolve()
+        if path is None:
+            return self._reply(400)
+
+        self._reply(200 if os.path.exists(path) else 404)
+
+
+    def do_PUT(self):
+        kind, path = self._resolve()
+        if path is None:
+            return self._reply(400, b"bad path")
+
+        os.makedirs(os.path.dirname(path),
+                    exist_ok = True)
+
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                self._read_body(fp)
+
+            if kind == "cas" and hash_file(tmp_path).hex() != os.path.basename(path):
+                os.unlink(tmp_path)
+                return self._reply(400, b"digest mismatch")
+
+            os.replace(tmp_path,
+                       path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self._reply(201)
+
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/cas/find_missing":
+            return self._reply(404, b"not found")
+
+        length = int(self.headers.get("Content-Length", 0))
+        digests = self.rfile.read(length).decode("ascii").split()
+
+        missing = [d
+                   for d in digests
+                   if not _DIGEST_RE.match(d) or not os.path.exists(os.path.join(self.server.directory,
+                                                                                 "cas",
+                                                                                 d[:2],
+                                                                                 d))]
+
+        self._reply(200, "\n".join(missing).encode("ascii"))
+
+
+    def log_message(self,
+                    format,
+                    *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 address,
+                 directory,
+                 verbose = False):
+        super().__init__(address,
+                         CacheRequestHandler)
+
+        self.directory = os.path.abspath(directory)
+        self.verbose = verbose
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "reference xenbuild remote cache server")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8090)
+    parser.add_argument("--dir", default = "remote-cache")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args(argv)
+
+    server = CacheServer((args.host, args.port),
+                         args.dir,
+                         args.verbose)
+    print(f"[!] serving {server.directory} on http://{args.host}:{server.server_address[1]}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import subprocess as sp
+
+
+# the client side of bootstrap.daemon, kept free of heavy imports so that
+# talking to a warm server costs little more than interpreter startup
+
+
+def socket_path(repo_root):
+    path = os.path.join(os.path.abspath(repo_root),
+                        "build",
+                        "xenbuild.sock")
+
+    # unix socket paths are limited to ~108 bytes
+    if len(os.fsencode(path)) < 100:
+        return path
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/tmp")
+    digest = hashlib.blake2b(os.fsencode(os.path.abspath(repo_root)),
+                             digest_size = 8).hexdigest()
+
+    return os.path.join(runtime_dir, f"xenbuild-{digest}.sock")
+
+
+def request(repo_root,
+            message):
+    # returns the server's exit status, or None when no server is running
+    path = socket_path(repo_root)
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX,
+                         socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        socket.send_fds(sock,
+                        [json.dumps(message).encode("utf-8") + b"\n"],
+                        [sys.stdout.fileno(), sys.stderr.fileno()])
+
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                return 1
+
+            data += chunk
+
+    return json.loads(data)["status"]
+
+
+def start(repo_root,
+          argv):
+    repo_root = os.path.abspath(repo_root)
+    if request(repo_root, {"command": "status"}) is not None:
+        return 0
+
+    log_path = os.path.join(repo_root,
+                            "build",
+                            "xenbuild-server.log")
+    os.makedirs(os.path.dirname(log_path),
+                exist_ok = True)
+
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(log_path, "ab") as log:
+        sp.Popen([sys.executable, "-m", "bootstrap.daemon", "--root", repo_root] + argv,
+                 cwd = package_root,
+                 stdin = sp.DEVNULL,
+                 stdout = log,
+                 stderr = log,
+                 start_new_session = True)
+
+    # the first load evaluates every BUILD file, give it time
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if os.path.exists(socket_path(repo_root)):
+            print(f"[!] xenbuild server started, log at {log_path}")
+            return 0
+
+        time.sleep(0.05)
+
+    print(f"error: xenbuild server did not start, see {log_path}")
+
+    return 1
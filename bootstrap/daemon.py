@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import selectors
+import contextlib
+import traceback
+
+from .client import socket_path
+from .builder import Builder
+from .watch import Inotify, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_ISDIR
+from .cache import default_cache_dir, parse_size
+from .trace import Tracer
+
+
+class Workspace:
+    def __init__(self,
+                 builder):
+        self.builder = builder
+
+        # BUILD file -> names of the targets it defined
+        self.file_targets = {}
+        self.dirty = set()
+        self.dag = None
+
+        self.reload()
+
+
+    def reload(self):
+        self.builder.eval_ctx.targets.clear()
+        self.file_targets = {}
+        self.dirty = set()
+
+        build_files = self.builder.discover_build_files()
+        for build_file in build_files:
+            self._load(build_file)
+
+        self.builder.ast_cache.prune(build_files)
+        self.builder.save_caches()
+
+        self.dag = self.builder.graph_from_targets()
+
+
+    def _load(self,
+              build_file):
+        targets = self.builder.evaluate_build_file(build_file)
+        self.file_targets[build_file] = [t.props["name"]
+                                         for t in targets]
+
+
+    def mark_dirty(self,
+                   path,
+                   mask):
+        if os.path.basename(path) == "BUILD":
+            self.dirty.add(path)
+            return
+
+        if not mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+            return
+
+        if path.startswith(os.path.join(self.builder.repo_root, "build", "")):
+            return
+
+        # adding or removing a file can change the glob() results of any
+        # package above it
+        directory = os.path.dirname(path)
+        while directory.startswith(self.builder.repo_root):
+            build_file = os.path.join(directory, "BUILD")
+            if build_file in self.file_targets:
+                self.dirty.add(build_file)
+
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+
+            directory = parent
+
+
+    def refresh(self):
+        if not self.dirty:
+            return
+
+        targets = self.builder.eval_ctx.targets
+        for build_file in self.dirty:
+            for name in self.file_targets.pop(build_file, []):
+                targets.pop(name, None)
+
+            if os.path.exists(build_file):
+                self._load(build_file)
+
+        self.dirty = set()
+
+        self.builder.save_caches()
+        self.dag = self.builder.graph_from_targets()
+
+
+    def build(self,
+              target_names,
+              jobs,
+              keep_going = False):
+        self.refresh()
+
+        self.builder.jobs = jobs or os.cpu_count() or 1
+        self.builder.keep_going = keep_going
+
+        return self.builder.build_targets(target_names,
+                                          dag = self.dag)
+
+
+class BuildServer:
+    def __init__(self,
+                 repo_root,
+                 options):
+        self.repo_root = os.path.abspath(repo_root)
+
+        # the command line options the server was started with, build
+        # requests may override any of them
+        self.options = options
+        self.workspaces = {}
+        self.workspace_options = {}
+
+        self.inotify = Inotify()
+        self.inotify.watch_tree(self.repo_root)
+
+        self.path = socket_path(self.repo_root)
+        self.running = False
+
+
+    def workspace(self,
+                  debug,
+                  overrides = None):
+        options = builder_options(dict(self.options,
+                                       **(overrides or {})))
+
+        if debug in self.workspaces and self.workspace_options[debug] != options:
+            print("[!] build options differ from the server's, reloading")
+            del self.workspaces[debug]
+
+        if debug not in self.workspaces:
+            builder = Builder(self.repo_root,
+                              debug = debug,
+                              **options)
+            self.workspaces[debug] = Workspace(builder)
+            self.workspace_options[debug] = options
+        elif not self.inotify.complete:
+            # some directories are not watched, their changes never show
+            # up as events
+            self.workspaces[debug].reload()
+
+        workspace = self.workspaces[debug]
+        workspace.builder.build_state().watched = self.inotify.complete
+
+        return workspace
+
+
+    def process_events(self):
+        for path, mask in self.inotify.read_events():
+            if path is None:
+                # the kernel queue overflowed, nothing can be trusted
+                for workspace in self.workspaces.values():
+                    workspace.builder.build_state().invalidate()
+                    workspace.reload()
+
+                continue
+
+            rel_path = os.path.relpath(path,
+                                       self.repo_root)
+            for workspace in self.workspaces.values():
+                state = workspace.builder.build_state()
+                if mask & IN_ISDIR:
+                    state.invalidate()
+                else:
+                    state.invalidate(rel_path)
+
+                workspace.mark_dirty(path,
+                                     mask)
+
+
+    def serve_forever(self):
+        os.makedirs(os.path.dirname(self.path),
+                    exist_ok = True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        listener = socket.socket(socket.AF_UNIX,
+                                 socket.SOCK_STREAM)
+        # evaluate the repo before the socket shows up, clients that find
+        # it can rely on a warm graph
+        self.workspace(True)
+
+        listener.bind(self.path)
+        listener.listen(8)
+
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ, "client")
+        selector.register(self.inotify, selectors.EVENT_READ, "inotify")
+
+        print(f"[!] xenbuild server listening on {self.path}")
+        sys.stdout.flush()
+
+        self.running = True
+        try:
+            while self.running:
+                for key, _ in selector.select():
+                    if key.data == "inotify":
+                        self.process_events()
+                        continue
+
+                    conn, _ = listener.accept()
+                    with conn:
+                        self._serve(conn)
+        finally:
+            selector.close()
+            listener.close()
+            self.inotify.close()
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+    def _serve(self,
+               conn):
+        data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 2)
+        while not data.endswith(b"\n"):
+            chunk = conn.recv(1 << 16)
+            if not chunk:
+                break
+
+            data += chunk
+
+        try:
+            request = json.loads(data)
+        except ValueError:
+            for fd in fds:
+                os.close(fd)
+            return
+
+        status = 0
+        with _redirect_output(fds):
+            try:
+                status = self._handle(request)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+
+        conn.sendall(json.dumps({"status": status}).encode("utf-8") + b"\n")
+
+
+    def _handle(self,
+                request):
+        command = request.get("command")
+
+        if command == "shutdown":
+            print("[!] xenbuild server shutting down")
+            self.running = False
+
+            return 0
+
+        if command == "status":
+            print(f"[!] xenbuild server for {self.repo_root}, pid {os.getpid()}")
+            for debug, workspace in self.workspaces.items():
+                print(f"\t~> {'debug' if debug else 'release'}: {len(workspace.builder.eval_ctx.targets)} targets")
+
+            return 0
+
+        if command == "build":
+            self.process_events()
+
+            try:
+                workspace = self.workspace(request.get("debug", True),
+                                           request.get("options"))
+            except ValueError as err:
+                print(f"error: {err}")
+                return 1
+
+            trace = request.get("trace")
+            if trace is None:
+                ok = workspace.build(request.get("targets"),
+                                     request.get("jobs"),
+                                     request.get("keep_going", False))
+
+                return 0 if ok else 1
+
+            # only covers what the build request itself had to redo, the
+            # graph was loaded long before
+            workspace.builder.tracer = Tracer()
+            try:
+                ok = workspace.build(request.get("targets"),
+                                     request.get("jobs"),
+                                     request.get("keep_going", False))
+            finally:
+                workspace.builder.tracer.save(trace)
+                workspace.builder.tracer = Tracer(enabled = False)
+                print(f"[!] trace written to {trace}")
+
+            return 0 if ok else 1
+
+        print(f"error: unknown server command: {command}")
+
+        return 1
+
+
+def builder_options(options):
+    # Builder keyword arguments from command line style options
+    return {"cache_dir": None if options["no_cache"] else options["cache_dir"] or default_cache_dir(),
+            "cache_size": parse_size(options["cache_size"]),
+            "remote_cache": options["remote_cache"],
+            "workers": options["workers"] and options["workers"].split(","),
+            "unity": int(options["unity"]),
+            "archive": options["archive"]}
+
+
+@contextlib.contextmanager
+def _redirect_output(fds):
+    if len(fds) != 2:
+        for fd in fds:
+            os.close(fd)
+
+        yield
+        return
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    saved = os.dup(1), os.dup(2)
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + tuple(fds):
+            os.close(fd)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "long-running xenbuild server")
+    parser.add_argument("--root", default = ".")
+    parser.add_argument("--cache-dir", default = default_cache_dir())
+    parser.add_argument("--cache-size", default = "10G")
+    parser.add_argument("--no-cache", action = "store_true")
+    parser.add_argument("--remote-cache", default = os.environ.get("XENBUILD_REMOTE_CACHE"))
+    parser.add_argument("--workers", default = os.environ.get("XENBUILD_WORKERS"))
+    parser.add_argument("--unity", type = int, default = 0)
+    parser.add_argument("--archive", default = "full")
+    args = parser.parse_args(argv)
+
+    os.chdir(args.root)
+
+    server = BuildServer(".",
+                         {"cache_dir": args.cache_dir,
+                          "cache_size": args.cache_size,
+                          "no_cache": args.no_cache,
+                          "remote_cache": args.remote_cache,
+                          "workers": args.workers,
+                          "unity": args.unity,
+                          "archive": args.archive})
+    server.serve_forever()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,3 +1,6 @@
+from collections import deque
+
+
 class DAG:
     def __init__(self):
         self.nodes = {}
@@ -19,7 +22,8 @@ class DAG:
 
     def add_edge(self,
                  from_node,
-                 to_node):
+                 to_node,
+                 check_cycles = True):
         if from_node not in self.nodes:
             raise ValueError(f"Node {from_node} does not exist")
         if to_node not in self.nodes:
@@ -28,13 +32,25 @@ class DAG:
         self.edges[from_node].add(to_node)
         self.reverse_edges[to_node].add(from_node)
 
-        if self._creates_cycle(from_node, to_node):
+        if check_cycles and self._creates_cycle(from_node, to_node):
             self.edges[from_node].remove(to_node)
             self.reverse_edges[to_node].remove(from_node)
 
             raise ValueError(f"Adding edge {from_node} -> {to_node} would create a cycle")
 
 
+    def add_edges(self,
+                  edges):
+        for from_node, to_node in edges:
+            self.add_edge(from_node,
+                          to_node,
+                          check_cycles = False)
+
+        cycle = self.find_cycle()
+        if cycle is not None:
+            raise ValueError(f"Dependency graph contains a cycle: {self._format_cycle(cycle)}")
+
+
     def _creates_cycle(self,
                        from_node,
                        to_node):
@@ -45,10 +61,10 @@ class DAG:
                       start,
                       end):
         visited = set()
-        queue = [start]
+        queue = deque([start])
 
         while queue:
-            current = queue.pop(0)
+            current = queue.popleft()
             if current == end:
                 return True
             if current in visited:
@@ -87,26 +103,199 @@ class DAG:
     def topological_sort(self):
         in_degree = {node: len(self.reverse_edges[node])
                      for node in self.nodes}
-        queue = [node
-                 for node, degree in in_degree.items()
-                 if degree == 0]
+        queue = deque(node
+                      for node, degree in in_degree.items()
+                      if degree == 0)
 
         result = []
         while queue:
-            current = queue.pop(0)
+            current = queue.popleft()
             result.append(current)
 
-            for dependent in list(self.edges[current]):
+            for dependent in self.edges[current]:
                 in_degree[dependent] -= 1
                 if in_degree[dependent] == 0:
                     queue.append(dependent)
 
         if len(result) != len(self.nodes):
-            raise ValueError("Dependency graph contains a cycle, cannot perform topological sort")
+            cycle = self.find_cycle()
+            raise ValueError(f"Dependency graph contains a cycle, cannot perform topological sort: {self._format_cycle(cycle)}")
+
+        return result
+
+
+    def find_cycle(self):
+        # iterative tarjan, returns the first non-trivial strongly connected
+        # component found as a concrete cycle, or None for an acyclic graph
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+
+        for root in self.nodes:
+            if root in index:
+                continue
+
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            work = [(root, iter(self.edges[root]))]
+            while work:
+                node, neighbors = work[-1]
+
+                descended = False
+                for neighbor in neighbors:
+                    if neighbor not in index:
+                        index[neighbor] = lowlink[neighbor] = len(index)
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+
+                        work.append((neighbor, iter(self.edges[neighbor])))
+                        descended = True
+
+                        break
+
+                    if neighbor in on_stack:
+                        lowlink[node] = min(lowlink[node], index[neighbor])
+
+                if descended:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] != index[node]:
+                    continue
+
+                component = set()
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.add(member)
+
+                    if member == node:
+                        break
+
+                if len(component) > 1 or node in self.edges[node]:
+                    return self._cycle_in(component, node)
+
+        return None
+
+
+    def _cycle_in(self,
+                  component,
+                  start):
+        path = [start]
+        seen = {start: 0}
+
+        current = start
+        while True:
+            current = next(n
+                           for n in self.edges[current]
+                           if n in component)
+            if current in seen:
+                return path[seen[current]:] + [current]
+
+            seen[current] = len(path)
+            path.append(current)
+
+
+    def _format_cycle(self,
+                      cycle):
+        if not cycle:
+            return "unknown"
+
+        return " -> ".join(str(node) for node in cycle)
+
+
+    def longest_paths(self,
+                      weights):
+        # weight of the heaviest path from each weighted node to a sink,
+        # nodes without a weight are ignored
+        result = {}
+
+        for node in reversed(self.topological_sort()):
+            if node not in weights:
+                continue
+
+            heaviest = 0
+            for dependent in self.edges[node]:
+                if dependent in result and result[dependent] > heaviest:
+                    heaviest = result[dependent]
+
+            result[node] = weights[node] + heaviest
 
         return result
 
 
+    def critical_path(self,
+                      weights):
+        # the heaviest chain of weighted nodes, from a source to a sink
+        totals = self.longest_paths(weights)
+        if not totals:
+            return []
+
+        node = max(totals,
+                   key = totals.get)
+        path = [node]
+        while True:
+            successors = [d for d in self.edges[node] if d in totals]
+            if not successors:
+                break
+
+            node = max(successors,
+                       key = totals.get)
+            path.append(node)
+
+        return path
+
+
+    def reachable(self,
+                  starts,
+                  reverse = False):
+        # every node reachable from starts (included) following edges, or
+        # dependencies when reverse is set
+        edges = self.reverse_edges if reverse else self.edges
+
+        visited = set(starts)
+        queue = deque(visited)
+        while queue:
+            current = queue.popleft()
+            for neighbor in edges[current]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    queue.append(neighbor)
+
+        return visited
+
+
+    def find_path(self,
+                  start,
+                  end):
+        # a shortest path from start to end following edges, or None
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if current == end:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = parents[current]
+
+                return path[::-1]
+
+            for neighbor in self.edges[current]:
+                if neighbor not in parents:
+                    parents[neighbor] = current
+                    queue.append(neighbor)
+
+        return None
+
+
     def find_all_paths(self,
                        start,
                        end):
@@ -0,0 +1,144 @@
+import os
+
+
+def parse_depfile(path):
+    with open(path, "r") as fp:
+        content = fp.read()
+
+    content = content.replace("\\\r\n", " ").replace("\\\n", " ")
+
+    prerequisites = []
+    for line in content.splitlines():
+        colon = _find_rule_separator(line)
+        if colon < 0:
+            continue
+
+        prerequisites.extend(_split_paths(line[colon + 1:]))
+
+    return prerequisites
+
+
+def _find_rule_separator(line):
+    # skip drive letters and escaped colons, only `target: deps` separates
+    i = 0
+    while i < len(line):
+        if line[i] == "\\":
+            i += 2
+            continue
+
+        if line[i] == ":" and (i + 1 >= len(line) or line[i + 1].isspace()):
+            return i
+
+        i += 1
+
+    return -1
+
+
+def _split_paths(text):
+    paths = []
+    current = ""
+
+    i = 0
+    while i < len(text):
+        ch = text[i]
+
+        if ch == "\\" and i + 1 < len(text) and text[i + 1] in " #":
+            current += text[i + 1]
+            i += 2
+
+            continue
+
+        if ch == "$" and i + 1 < len(text) and text[i + 1] == "$":
+            current += "$"
+            i += 2
+
+            continue
+
+        if ch.isspace():
+            if current:
+                paths.append(current)
+                current = ""
+        else:
+            current += ch
+
+        i += 1
+
+    if current:
+        paths.append(current)
+
+    return paths
+
+
+class HeaderIndex:
+    def __init__(self):
+        self.paths = []
+        self.ids = {}
+        self.objects = {}
+
+
+    def intern(self,
+               path):
+        path = os.path.normpath(path)
+
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+
+            self.paths.append(path)
+            self.ids[path] = path_id
+
+        return path_id
+
+
+    def update(self,
+               obj,
+               source,
+               depfile):
+        try:
+            prerequisites = parse_depfile(depfile)
+        except OSError:
+            self.objects.pop(obj, None)
+            return
+
+        source = os.path.normpath(source)
+        self.objects[obj] = tuple(sorted({self.intern(p)
+                                          for p in prerequisites
+                                          if os.path.normpath(p) != source}))
+
+
+    def headers(self,
+                obj):
+        return [self.paths[i]
+                for i in self.objects.get(obj, ())]
+
+
+    def forget(self,
+               obj):
+        self.objects.pop(obj, None)
+
+
+    def to_dict(self):
+        live = sorted({i
+                       for ids in self.objects.values()
+                       for i in ids})
+        remap = {old: new
+                 for new, old in enumerate(live)}
+
+        return {
+            "paths": [self.paths[i] for i in live],
+            "objects": {obj: [remap[i] for i in ids]
+                        for obj, ids in self.objects.items()},
+        }
+
+
+    @classmethod
+    def from_dict(cls,
+                  data):
+        index = cls()
+        index.paths = list(data.get("paths", []))
+        index.ids = {path: i
+                     for i, path in enumerate(index.paths)}
+        index.objects = {obj: tuple(ids)
+                         for obj, ids in data.get("objects", {}).items()}
+
+        return index
@@ -0,0 +1,246 @@
+import os
+import re
+import marshal
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .state import hash_bytes
+from .fsutil import atomic_write
+
+
+MANIFEST_VERSION = 1
+
+IGNORE_FILES = (".gitignore", ".xenbuildignore")
+
+# never worth descending into, whatever the ignore files say
+ALWAYS_IGNORED = (".git", ".hg", ".svn", "__pycache__")
+
+
+def _translate(pattern):
+    regex = ""
+
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+
+            continue
+
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+
+            continue
+
+        if ch == "*":
+            regex += "[^/]*"
+        elif ch == "?":
+            regex += "[^/]"
+        elif ch == "[":
+            end = pattern.find("]", i + 1)
+            if end < 0:
+                regex += "\\["
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+
+                regex += f"[{body}]"
+                i = end
+        elif ch == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 1
+        else:
+            regex += re.escape(ch)
+
+        i += 1
+
+    return regex
+
+
+class IgnoreRules:
+    def __init__(self,
+                 lines = ()):
+        # (compiled pattern, negated, directories only)
+        self.rules = []
+
+        for line in lines:
+            self.add(line)
+
+
+    @classmethod
+    def load(cls,
+             repo_root,
+             names = IGNORE_FILES):
+        lines = []
+        for name in names:
+            try:
+                with open(os.path.join(repo_root, name), "r") as fp:
+                    lines.extend(fp.read().splitlines())
+            except OSError:
+                continue
+
+        return cls(lines)
+
+
+    def add(self,
+            line):
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return
+
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return
+
+        # a slash anywhere but at the end anchors the pattern to the root
+        if "/" in line:
+            regex = _translate(line.lstrip("/"))
+        else:
+            regex = "(?:.*/)?" + _translate(line)
+
+        self.rules.append((re.compile(f"^{regex}$"), negated, directory_only))
+
+
+    def ignored(self,
+                rel_path,
+                is_dir):
+        result = False
+        for pattern, negated, directory_only in self.rules:
+            if directory_only and not is_dir:
+                continue
+
+            if pattern.match(rel_path):
+                result = not negated
+
+        return result
+
+
+class BuildFileFinder:
+    def __init__(self,
+                 repo_root,
+                 output_dir = "build",
+                 manifest_path = None,
+                 workers = None):
+        self.repo_root = os.path.abspath(repo_root)
+        self.output_dir = output_dir
+        self.manifest_path = manifest_path
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+
+        self.rules = IgnoreRules.load(self.repo_root)
+
+        # rel dir -> (mtime_ns, has BUILD, subdirectories)
+        self.manifest = {}
+
+
+    def _rules_digest(self):
+        parts = []
+        for name in IGNORE_FILES:
+            try:
+                with open(os.path.join(self.repo_root, name), "rb") as fp:
+                    parts.append(fp.read())
+            except OSError:
+                parts.append(b"")
+
+        parts.append(self.output_dir.encode("utf-8"))
+
+        return hash_bytes(b"\0".join(parts))
+
+
+    def _load_manifest(self,
+                       rules_digest):
+        if self.manifest_path is None:
+            return {}
+
+        try:
+            with open(self.manifest_path, "rb") as fp:
+                version, digest, manifest = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+
+        if version != MANIFEST_VERSION or digest != rules_digest:
+            return {}
+
+        return manifest
+
+
+    def _skip(self,
+              rel_path,
+              name,
+              is_dir):
+        if is_dir and (name in ALWAYS_IGNORED or rel_path == self.output_dir):
+            return True
+
+        return self.rules.ignored(rel_path,
+                                  is_dir)
+
+
+    def _visit(self,
+               rel_dir,
+               previous):
+        path = os.path.join(self.repo_root, rel_dir) if rel_dir else self.repo_root
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return rel_dir, None
+
+        known = previous.get(rel_dir)
+        if known is not None and known[0] == mtime:
+            return rel_dir, known
+
+        has_build = False
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+
+                    if entry.is_dir(follow_symlinks = False):
+                        if not self._skip(rel_path, entry.name, True):
+                            subdirs.append(rel_path)
+                    elif entry.name == "BUILD" and entry.is_file():
+                        has_build = not self._skip(rel_path, entry.name, False)
+        except OSError:
+            return rel_dir, None
+
+        return rel_dir, (mtime, has_build, tuple(sorted(subdirs)))
+
+
+    def find(self):
+        rules_digest = self._rules_digest()
+        previous = self._load_manifest(rules_digest)
+
+        manifest = {}
+        with ThreadPoolExecutor(max_workers = self.workers) as pool:
+            pending = {pool.submit(self._visit, "", previous)}
+
+            while pending:
+                done, pending = wait(pending,
+                                     return_when = FIRST_COMPLETED)
+                for future in done:
+                    rel_dir, entry = future.result()
+                    if entry is None:
+                        continue
+
+                    manifest[rel_dir] = entry
+                    for subdir in entry[2]:
+                        pending.add(pool.submit(self._visit, subdir, previous))
+
+        if self.manifest_path is not None and manifest != previous:
+            atomic_write(self.manifest_path,
+                         marshal.dumps((MANIFEST_VERSION, rules_digest, manifest)))
+
+        self.manifest = manifest
+
+        return sorted(os.path.join(self.repo_root, rel_dir, "BUILD") if rel_dir else os.path.join(self.repo_root, "BUILD")
+                      for rel_dir, (_, has_build, _) in manifest.items()
+                      if has_build)
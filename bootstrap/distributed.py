@@ -0,0 +1,248 @@
+import os
+import time
+import shlex
+import socket
+import threading
+import subprocess as sp
+
+from .worker import DEFAULT_PORT, send_message, recv_message, unsafe_argument
+
+
+# flags that only matter to the local preprocessing step, forced includes
+# are already expanded in the preprocessed source. link flags ride along on
+# compile lines through the deps' flags and mean nothing to a compile
+_LOCAL_FLAGS = ("-MD", "-MMD", "-Winvalid-pch", "-rdynamic", "-static", "-shared")
+_LOCAL_OPTIONS = ("-MF", "-MT", "-MQ", "-include", "-include-pch", "-imacros",
+                  "-isystem", "-iquote", "-idirafter")
+_LOCAL_PREFIXES = ("-L", "-l", "-isystem", "-iquote", "-idirafter")
+
+RETRY_AFTER = 30.0
+
+
+class Worker:
+    def __init__(self,
+                 address):
+        host, _, port = address.rpartition(":")
+        if not host:
+            host, port = address, DEFAULT_PORT
+
+        self.address = address
+        self.host = host
+        self.port = int(port)
+
+        self.idle = []
+        self.inflight = 0
+        self.jobs = None
+        self.load = 0
+        self.down_until = 0.0
+
+
+    def score(self):
+        return max(self.inflight, self.load) / (self.jobs or 1)
+
+
+class WorkerPool:
+    def __init__(self,
+                 addresses,
+                 timeout = 60.0):
+        self.workers = [Worker(a)
+                        for a in addresses]
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+
+    def _connect(self,
+                 worker):
+        with self.lock:
+            if worker.idle:
+                return worker.idle.pop()
+
+        return socket.create_connection((worker.host, worker.port),
+                                        timeout = self.timeout)
+
+
+    def _release(self,
+                 worker,
+                 conn):
+        with self.lock:
+            worker.idle.append(conn)
+
+
+    def _fail(self,
+              worker,
+              err):
+        with self.lock:
+            already_down = worker.down_until > time.monotonic()
+            worker.down_until = time.monotonic() + RETRY_AFTER
+
+            for conn in worker.idle:
+                conn.close()
+            worker.idle = []
+
+        if not already_down:
+            print(f"WARNING: compile worker {worker.address} failed, compiling locally: {err}\n", end = "")
+
+
+    def _probe(self,
+               worker):
+        # learns the worker's capacity the first time it is considered
+        try:
+            conn = self._connect(worker)
+            send_message(conn,
+                         {"op": "status"})
+            header, _ = recv_message(conn)
+            if header is None:
+                raise ConnectionError("worker closed the connection")
+        except (OSError, ValueError) as err:
+            self._fail(worker, err)
+            return
+
+        with self.lock:
+            worker.jobs = header.get("jobs", 1)
+            worker.load = header.get("load", 0)
+
+        self._release(worker,
+                      conn)
+
+
+    def _pick(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.jobs is None and worker.down_until <= now:
+                self._probe(worker)
+
+        with self.lock:
+            live = [w for w in self.workers
+                    if w.jobs is not None and w.down_until <= time.monotonic()]
+            if not live:
+                return None
+
+            # a saturated pool leaves the action to the local machine
+            worker = min(live,
+                         key = Worker.score)
+            if worker.score() >= 1:
+                return None
+
+            worker.inflight += 1
+
+        return worker
+
+
+    def compile(self,
+                action):
+        # returns (returncode, output) or None when the action has to run
+        # locally instead
+        argv = shlex.split(action.cmd)
+        if "-c" not in argv or "-o" not in argv or action.inputs[0] not in argv:
+            return None
+
+        worker = self._pick()
+        if worker is None:
+            return None
+
+        try:
+            return self._compile(worker,
+                                 action,
+                                 argv)
+        finally:
+            with self.lock:
+                worker.inflight -= 1
+
+
+    def _compile(self,
+                 worker,
+                 action,
+                 argv):
+        remote = []
+        skip = False
+        for arg in argv:
+            if skip:
+                skip = False
+            elif arg in _LOCAL_FLAGS:
+                continue
+            elif arg in _LOCAL_OPTIONS:
+                skip = True
+            elif arg.startswith(_LOCAL_PREFIXES):
+                continue
+            elif arg == action.inputs[0]:
+                remote.append("input.ii")
+            else:
+                remote.append(arg)
+        remote[remote.index("-o") + 1] = "output.o"
+
+        # flags the workers refuse keep this one action local
+        if unsafe_argument({"argv": remote, "input": "input.ii", "output": "output.o"}) is not None:
+            return None
+
+        preprocessed = f"{action.output}.{threading.get_ident()}.ii"
+
+        # preprocessing stays local, it also writes the depfile
+        local = list(argv)
+        local[local.index("-c")] = "-E"
+        local[local.index("-o") + 1] = preprocessed
+        local += ["-MT", action.output]
+
+        # a precompiled header can't be preprocessed into the source, its
+        # stub next to it is included textually instead
+        if "-include-pch" in local:
+            i = local.index("-include-pch")
+            local[i:i + 2] = ["-include", os.path.splitext(local[i + 1])[0]]
+
+        try:
+            result = sp.run(local,
+                            stdin = sp.DEVNULL,
+                            stdout = sp.PIPE,
+                            stderr = sp.STDOUT)
+        except OSError:
+            return None
+
+        output = result.stdout.decode("utf-8", "replace")
+        if result.returncode != 0:
+            if os.path.exists(preprocessed):
+                os.unlink(preprocessed)
+
+            return result.returncode, output
+
+        try:
+            with open(preprocessed, "rb") as fp:
+                source = fp.read()
+        finally:
+            os.unlink(preprocessed)
+
+        try:
+            conn = self._connect(worker)
+            send_message(conn,
+                         {"op": "compile",
+                          "argv": remote,
+                          "input": "input.ii",
+                          "output": "output.o"},
+                         source)
+            header, obj = recv_message(conn)
+            if header is None:
+                raise ConnectionError("worker closed the connection")
+        except (OSError, ValueError) as err:
+            self._fail(worker, err)
+            return None
+
+        self._release(worker,
+                      conn)
+
+        with self.lock:
+            worker.load = header.get("load", 0)
+
+        if header.get("refused"):
+            return None
+
+        if "error" in header:
+            self._fail(worker, header["error"])
+            return None
+
+        if header["returncode"] == 0:
+            tmp_path = f"{action.output}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(obj)
+
+            os.replace(tmp_path,
+                       action.output)
+
+        return header["returncode"], output + header.get("output", "")
@@ -1,4 +1,6 @@
+import os
 import re
+import functools
 import subprocess as sp
 
 from enum import Enum, auto
@@ -6,13 +8,29 @@ from dataclasses import dataclass
 from typing import List, Dict, Any, Optional, Union, Callable
 
 from .ast import ASTNode, String, List, Variable, RuleCall, Target
+from .pkgconfig import PkgConfig
+from .globindex import GlobIndex
+from .unity import unity_batches, unity_name
 
 
 class EvaluationContext:
     def __init__(self,
                  repo_root,
-                 debug = True):
+                 debug = True,
+                 pkgconfig = None,
+                 glob_index = None,
+                 unity = 0,
+                 thin_archives = False):
         self.debug = debug
+        self.thin_archives = thin_archives
+
+        # default unity batch size for targets that don't set one, 0 is off
+        self.unity = unity
+        self.pkgconfig = pkgconfig or PkgConfig()
+        self.glob_index = glob_index or GlobIndex(repo_root)
+
+        # system_cc_library targets waiting for resolve_system_libraries()
+        self.unresolved = []
 
         self.variables = {}
         self.rules = {}
@@ -50,19 +68,8 @@ class EvaluationContext:
         if not pattern:
             raise ValueError("glob() requires a pattern")
 
-        import glob as glob_module
-        import os
-
-        full_pattern = os.path.join(self.repo_root,
-                                    self.current_dir,
-                                    pattern)
-        matching_files = glob_module.glob(full_pattern,
-                                          recursive = True)
-
-        prefix_len = len(os.path.join(self.repo_root,
-                                      self.current_dir)) + 1
-        relative_files = [f[prefix_len:]
-                          for f in matching_files if os.path.isfile(f)]
+        relative_files = self.glob_index.glob(self.current_dir,
+                                              pattern)
 
         return List([String(f) for f in relative_files])
 
@@ -73,43 +80,33 @@ class EvaluationContext:
         if not name:
             raise ValueError("cc_binary() requires a name")
 
-        sources = args.get("sources", [])
-        includes = args.get("includes", [])
-        deps = args.get("deps", [])
-
-        full_sources = [f"./{self.current_dir}/{s}"
-                        for s in sources]
-        obj_files = [f"./build/obj/{self.current_dir}/{s.replace('.cc', '.o')}"
-                     for s in sources]
-
-        include_flags = [f"-I./{self.current_dir}/{inc}"
-                         for inc in includes]
-
-        debug_flags = "-g -O1 -DDEBUG" if self.debug else "-O2"
-
-        props = {
-            "name": f"@/{self.current_dir}/{name}",
-            "include_flags": include_flags,
-            "link_flags": [],
-            "in": full_sources,
-            "obj": obj_files,
-            "out": f"build/bin/{name}",
-            "build": f"c++ -c @IN@ -o @OBJ@ {''.join(include_flags)} @ARGS@ {debug_flags}",
-            "link": f"c++ @OBJ@ -o @OUT@ {''.join(include_flags)} @ARGS@ {debug_flags}",
-            "deps": deps
-        }
+        props = self._cc_props(name,
+                               args)
+        props["out"] = f"build/bin/{name}"
+        props["link"] = f"c++ @OBJ@ -o @OUT@ {' '.join(props['include_flags'])} @ARGS@ {self._debug_flags()}"
 
         return Target(props)
 
 
     def cc_library_rule(self,
                         args: Dict[str, Any]):
-        # TODO: remove duplicated code from cc_binary and cc_library rules
-
         name = args.get("name")
         if not name:
             raise ValueError("cc_library() requires a name")
 
+        props = self._cc_props(name,
+                               args)
+        props["link_flags"] = [f"-l{name}"]
+        props["out"] = f"build/lib/lib{name}.a"
+        # thin archives only reference the objects, which stay in build/obj
+        props["link"] = f"ar rcsT @OUT@ @OBJ@" if self.thin_archives else f"ar rcs @OUT@ @OBJ@"
+
+        return Target(props)
+
+
+    def _cc_props(self,
+                  name,
+                  args: Dict[str, Any]) -> Dict[str, Any]:
         sources = args.get("sources", [])
         includes = args.get("includes", [])
         deps = args.get("deps", [])
@@ -119,24 +116,93 @@ class EvaluationContext:
         obj_files = [f"./build/obj/{self.current_dir}/{s.replace('.cc', '.o')}"
                      for s in sources]
 
+        try:
+            batch_size = int(args.get("unity", self.unity) or 0)
+        except ValueError:
+            batch_size = -1
+
+        if batch_size < 0:
+            raise ValueError(f"unity of {name} must be a non-negative batch size")
+
+        unity = {}
+        unity_sources = []
+        if batch_size > 1 and len(sources) > 1:
+            # how each member compiles on its own, for compile_commands.json
+            unity_sources = [(s, obj, _dep_file(obj))
+                             for s, obj in zip(full_sources, obj_files)]
+
+            for batch in unity_batches(full_sources, batch_size):
+                unity[f"./build/unity/{self.current_dir}/{name}/{unity_name(batch)}.cc"] = batch
+
+            full_sources = list(unity)
+            obj_files = [f"./build/obj/{self.current_dir}/{name}.unity/{os.path.basename(u)[:-3]}.o"
+                         for u in unity]
+
+        dep_files = [_dep_file(obj)
+                     for obj in obj_files]
+
         include_flags = [f"-I./{self.current_dir}/{inc}"
                          for inc in includes]
 
-        debug_flags = "-g -O1 -DDEBUG" if self.debug else "-O2"
+        pch = None
+        pch_flags = ""
+        if args.get("pch"):
+            pch = self._pch_props(name,
+                                  args["pch"],
+                                  include_flags)
+            pch_flags = pch["flags"] + " "
 
-        props = {
+        return {
             "name": f"@/{self.current_dir}/{name}",
             "include_flags": include_flags,
-            "link_flags": [f"-l{name}"],
+            "link_flags": [],
             "in": full_sources,
             "obj": obj_files,
-            "out": f"build/lib/lib{name}.a",
-            "build": f"c++ -c @IN@ -o @OBJ@ {''.join(include_flags)} @ARGS@ {debug_flags}",
-            "link": f"ar rcs @OUT@ @OBJ@",
-            "deps": deps
+            "dep": dep_files,
+            "out": "",
+            "build": f"c++ -c @IN@ -o @OBJ@ -MMD -MF @DEP@ {pch_flags}{' '.join(include_flags)} @ARGS@ {self._debug_flags()}",
+            "link": "",
+            "deps": deps,
+            "unity": unity,
+            "unity_sources": unity_sources,
+            "pch": pch
         }
 
-        return Target(props)
+
+    def _pch_props(self,
+                   name,
+                   header,
+                   include_flags):
+        # the header is compiled through a generated stub that #includes it,
+        # gcc finds <stub>.gch through a plain -include of the stub while
+        # clang needs the .pch named explicitly
+        config = "debug" if self.debug else "release"
+        stub = f"./build/pch/{config}/{self.current_dir}/{name}/{os.path.basename(header)}"
+
+        if compiler_family() == "clang":
+            out = f"{stub}.pch"
+            flags = f"-include-pch {out}"
+
+            # clang rejects a .pch once a header's mtime moves, while the
+            # build state and the action cache only compare contents
+            build_flags = "-Xclang -fno-pch-timestamp "
+        else:
+            out = f"{stub}.gch"
+            flags = f"-include {stub} -Winvalid-pch"
+            build_flags = ""
+
+        return {
+            "header": f"./{self.current_dir}/{header}",
+            "stub": stub,
+            "out": out,
+            "dep": f"{stub}.d",
+            "flags": flags,
+            "build": f"c++ -x c++-header {build_flags}@IN@ -o @OUT@ -MMD -MF @DEP@ {' '.join(include_flags)} @ARGS@ {self._debug_flags()}"
+        }
+
+
+    def _debug_flags(self):
+        return "-g -O1 -DDEBUG" if self.debug else "-O2"
 
 
     def system_cc_library_rule(self,
@@ -145,31 +211,56 @@ class EvaluationContext:
         if not name:
             raise ValueError("system_cc_library() requires a name")
 
-        pkgconfig = args.get("pkgconfig", [])
-        links, includes = self._pkgconfig_call(pkgconfig)
-        links, includes = links.replace("\n", ""), includes.replace("\n", "")
-
         props = {
             "name": f"@/{self.current_dir}/{name}",
-            "include_flags": [includes],
-            "link_flags": [links],
+            "include_flags": [],
+            "link_flags": [],
             "in": [],
             "obj": [],
+            "dep": [],
             "out": "",
             "build": "",
             "link": "",
-            "deps": []
+            "deps": [],
+            "pkgconfig": args.get("pkgconfig", "")
         }
 
-        return Target(props)
+        target = Target(props)
+        self.unresolved.append(target)
+
+        return target
+
+
+    def resolve_system_libraries(self):
+        # pkg-config is queried once for everything evaluated so far rather
+        # than from inside each system_cc_library() call
+        if not self.unresolved:
+            return
+
+        results = self.pkgconfig.resolve([(t.props["name"], t.props["pkgconfig"])
+                                          for t in self.unresolved])
+        for target in self.unresolved:
+            includes, links = results[target.props["pkgconfig"]]
+            target.props["include_flags"] = [includes]
+            target.props["link_flags"] = [links]
+
+        self.unresolved = []
+
+
+def _dep_file(obj):
+    return f"{obj[:-2]}.d" if obj.endswith(".o") else f"{obj}.d"
 
 
-    def _pkgconfig_call(self,
-                        lib):
-        includes = sp.check_output(["pkg-config", "--cflags", lib])
-        links = sp.check_output(["pkg-config", "--libs", lib])
+@functools.lru_cache(maxsize = None)
+def compiler_family(cxx = "c++"):
+    try:
+        version = sp.run([cxx, "--version"],
+                         stdout = sp.PIPE,
+                         stderr = sp.DEVNULL).stdout.decode("utf-8", "replace")
+    except OSError:
+        return "gcc"
 
-        return links.decode("utf-8"), includes.decode("utf-8")
+    return "clang" if "clang" in version else "gcc"
 
 
 class Evaluator:
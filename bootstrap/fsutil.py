@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+
+def atomic_write(path,
+                 data):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory,
+                exist_ok = True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix = f".{os.path.basename(path)}-",
+                                    dir = directory)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(tmp_path,
+                   path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,202 @@
+import os
+import re
+import marshal
+
+from .fsutil import atomic_write
+
+
+GLOB_INDEX_VERSION = 1
+
+_MAGIC_RE = re.compile(r"[*?\[]")
+
+
+def _translate_component(component):
+    regex = ""
+
+    i = 0
+    while i < len(component):
+        ch = component[i]
+
+        if ch == "*":
+            regex += "[^/]*"
+        elif ch == "?":
+            regex += "[^/]"
+        elif ch == "[":
+            end = component.find("]", i + 2)
+            if end < 0:
+                regex += "\\["
+            else:
+                body = component[i + 1:end].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+
+                regex += f"[{body}]"
+                i = end
+        else:
+            regex += re.escape(ch)
+
+        i += 1
+
+    # like glob, wildcards never match a leading dot
+    if _MAGIC_RE.match(component):
+        regex = "(?!\\.)" + regex
+
+    return regex
+
+
+def compile_pattern(pattern):
+    components = [c for c in pattern.split("/") if c]
+
+    regex = ""
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+
+        if component == "**":
+            regex += "(?:(?!\\.)[^/]+/)*"
+            if last:
+                regex += "(?!\\.)[^/]+"
+        else:
+            regex += _translate_component(component)
+            if not last:
+                regex += "/"
+
+    return re.compile(f"^{regex}$")
+
+
+class GlobIndex:
+    def __init__(self,
+                 repo_root,
+                 path = None):
+        self.repo_root = repo_root
+        self.path = path
+
+        # rel dir -> (mtime_ns, files, subdirectories)
+        self.entries = None
+        self.dirty = False
+
+        # dirs already validated against the disk for the current package
+        self.fresh = set()
+        self.patterns = {}
+
+
+    def _load(self):
+        self.entries = {}
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, "rb") as fp:
+                version, entries = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+
+        if version == GLOB_INDEX_VERSION:
+            self.entries = entries
+
+
+    def save(self):
+        if not self.dirty or self.path is None:
+            return
+
+        atomic_write(self.path,
+                     marshal.dumps((GLOB_INDEX_VERSION, self.entries)))
+        self.dirty = False
+
+
+    def begin(self):
+        # called once per package, listings are re-checked against the
+        # directory mtimes the first time the package touches them
+        self.fresh = set()
+
+
+    def listing(self,
+                rel_dir):
+        if self.entries is None:
+            self._load()
+
+        entry = self.entries.get(rel_dir)
+        if rel_dir in self.fresh:
+            return entry
+
+        self.fresh.add(rel_dir)
+
+        path = os.path.join(self.repo_root, rel_dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            if self.entries.pop(rel_dir, None) is not None:
+                self.dirty = True
+
+            return None
+
+        if entry is not None and entry[0] == mtime:
+            return entry
+
+        files = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    if e.is_dir():
+                        dirs.append(e.name)
+                    elif e.is_file():
+                        files.append(e.name)
+        except OSError:
+            return None
+
+        entry = (mtime, tuple(sorted(files)), tuple(sorted(dirs)))
+        self.entries[rel_dir] = entry
+        self.dirty = True
+
+        return entry
+
+
+    def glob(self,
+             base_dir,
+             pattern):
+        # returns the files under base_dir (relative to the repo root)
+        # matching pattern, as paths relative to base_dir
+        compiled = self.patterns.get(pattern)
+        if compiled is None:
+            compiled = self.patterns[pattern] = compile_pattern(pattern)
+
+        components = [c for c in pattern.split("/") if c]
+
+        # the literal leading components only ever select one directory
+        prefix = []
+        while len(components) > 1 and not _MAGIC_RE.search(components[0]):
+            prefix.append(components.pop(0))
+
+        recursive = "**" in components
+        depth = len(components) - 1
+        hidden = any(c.startswith(".") for c in components)
+
+        start = "/".join(prefix)
+        matches = []
+
+        pending = [(start, 0)]
+        while pending:
+            rel, level = pending.pop()
+
+            entry = self.listing(os.path.normpath(os.path.join(base_dir, rel)))
+            if entry is None:
+                continue
+
+            _, files, dirs = entry
+            for name in files:
+                candidate = f"{rel}/{name}" if rel else name
+                if compiled.match(candidate):
+                    matches.append(candidate)
+
+            if not recursive and level >= depth:
+                continue
+
+            for name in dirs:
+                if name.startswith(".") and not hidden:
+                    continue
+
+                pending.append((f"{rel}/{name}" if rel else name, level + 1))
+
+        matches.sort()
+
+        return matches
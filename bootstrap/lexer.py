@@ -18,7 +18,7 @@ class TokenType(Enum):
     EOF = auto()
 
 
-@dataclass
+@dataclass(slots = True)
 class Token:
     type: TokenType
     value: str
@@ -26,131 +26,151 @@ class Token:
     col: int
 
 
-class Lexer:
-    def __init__(self,
-                 text: str):
-        self.text = text
-        self.pos = 0
-        self.line = 1
-        self.col = 1
-        self.current_char = self.text[0] if text else None
-
-
-    def advance(self):
-        self.pos += 1
-        if self.pos >= len(self.text):
-            self.current_char = None
-            return
-
-        self.current_char = self.text[self.pos]
-        if self.current_char == '\n':
-            self.line += 1
-            self.col = 1
-
-            return
-
-        self.col += 1
-
-
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
-
-
-    def identifier(self):
-        result = ''
+_TOKEN_RE = re.compile(r'''
+    \s*+
+    (?:
+        (?P<IDENTIFIER>(?:[^\W\d]|[@/])[\w:@/.\-]*+)
+      | (?P<STRING>"[^"\\]*+(?:\\.[^"\\]*+)*+"?)
+      | (?P<PUNCTUATION>[=,()\[\]])
+    )?
+''', re.VERBOSE | re.DOTALL)
 
-        while self.current_char is not None and (self.current_char.isalnum() or self.current_char in '_:@/.-'):
-            result += self.current_char
-            self.advance()
+_ESCAPE_RE = re.compile(r"\\(.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "t": "\t"}
 
-        return result
+_PUNCTUATION = {
+    "=": TokenType.EQUALS,
+    ",": TokenType.COMMA,
+    "(": TokenType.LPAREN,
+    ")": TokenType.RPAREN,
+    "[": TokenType.LBRACKET,
+    "]": TokenType.RBRACKET,
+}
 
 
-    def string(self):
-        result = ''
+def _unescape(match):
+    ch = match.group(1)
+    return _ESCAPES.get(ch, ch)
 
-        self.advance()
-        while self.current_char is not None and self.current_char != '"':
-            if self.current_char == '\\':
-                self.advance()
-                if self.current_char == 'n':
-                    result += '\n'
-                elif self.current_char == 't':
-                    result += '\t'
-                else:
-                    result += self.current_char
-            else:
-                result += self.current_char
 
-            self.advance()
+def _string_value(text):
+    value = text[1:]
+    if value.endswith('"') and not _is_escaped(value, len(value) - 1):
+        value = value[:-1]
 
-        self.advance()
+    if "\\" in value:
+        value = _ESCAPE_RE.sub(_unescape, value)
 
-        return result
+    return value
 
 
-    def get_next_token(self):
-        while self.current_char is not None:
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
+def _is_escaped(text,
+                pos):
+    backslashes = 0
+    while pos - backslashes - 1 >= 0 and text[pos - backslashes - 1] == "\\":
+        backslashes += 1
 
-            if self.current_char.isalpha() or self.current_char in '_@/':
-                return Token(TokenType.IDENTIFIER, self.identifier(), self.line, self.col)
+    return backslashes % 2 == 1
 
-            if self.current_char == '"':
-                return Token(TokenType.STRING, self.string(), self.line, self.col)
 
-            if self.current_char == '=':
-                token = Token(TokenType.EQUALS, '=', self.line, self.col)
-                self.advance()
+def _starts_identifier(char):
+    return char.isalpha() or char in "_@/"
 
-                return token
 
-            if self.current_char == ',':
-                token = Token(TokenType.COMMA, ',', self.line, self.col)
-                self.advance()
+class Lexer:
+    def __init__(self,
+                 text: str):
+        self.text = text
+        self._stream = None
+
+
+    def tokens(self):
+        text = self.text
+        end = len(text)
+        last = end - 1
+
+        count = text.count
+        find = text.find
+        rfind = text.rfind
+
+        identifier = TokenType.IDENTIFIER
+        string = TokenType.STRING
+        punctuation = _PUNCTUATION
+
+        # positions mirror the per-character scanner this replaced: the
+        # first line starts at column 1, later lines at column 2, a newline
+        # is reported at column 1, identifiers and strings carry the
+        # position right after them, and nothing past the last character
+        # is ever reported. positions only grow, so newlines are counted
+        # lazily, once the next unseen newline has been passed
+        line = 1
+        last_newline = 0
+        next_newline = find("\n", 1)
+        if next_newline < 0:
+            next_newline = end
+
+        for m in _TOKEN_RE.finditer(text):
+            kind = m.lastgroup
+
+            if kind is None:
+                at = m.end()
+                if at >= end:
+                    break
+            elif kind == "IDENTIFIER" and not _starts_identifier(text[m.start(kind)]):
+                # the start class also takes numerics such as `²` that are
+                # neither letters nor decimal digits
+                at = m.start(kind)
+                kind = None
+            elif kind == "PUNCTUATION":
+                at = m.start(kind)
+            else:
+                at = m.end()
+                if at > last:
+                    at = last
 
-                return token
+            if at >= next_newline:
+                line += count("\n", next_newline, at + 1)
+                last_newline = rfind("\n", next_newline, at + 1)
 
-            if self.current_char == '(':
-                token = Token(TokenType.LPAREN, '(', self.line, self.col)
-                self.advance()
+                next_newline = find("\n", at + 1)
+                if next_newline < 0:
+                    next_newline = end
 
-                return token
+            if at <= 0 or at == last_newline:
+                col = 1
+            else:
+                col = 1 + at - last_newline
 
-            if self.current_char == ')':
-                token = Token(TokenType.RPAREN, ')', self.line, self.col)
-                self.advance()
+            if kind is None:
+                raise Exception(f"invalid character: {text[at]} at line {line}, column {col}")
 
-                return token
+            value = m.group(kind)
+            if kind == "IDENTIFIER":
+                yield Token(identifier, value, line, col)
+            elif kind == "STRING":
+                yield Token(string, _string_value(value), line, col)
+            else:
+                yield Token(punctuation[value], value, line, col)
 
-            if self.current_char == '[':
-                token = Token(TokenType.LBRACKET, '[', self.line, self.col)
-                self.advance()
+        at = last
+        if at >= next_newline:
+            line += count("\n", next_newline, at + 1)
+            last_newline = rfind("\n", next_newline, at + 1)
 
-                return token
+        if at <= 0 or at == last_newline:
+            col = 1
+        else:
+            col = 1 + at - last_newline
 
-            if self.current_char == ']':
-                token = Token(TokenType.RBRACKET, ']', self.line, self.col)
-                self.advance()
+        yield Token(TokenType.EOF, '', line, col)
 
-                return token
 
-            raise Exception(f"invalid character: {self.current_char} at line {self.line}, column {self.col}")
+    def get_next_token(self):
+        if self._stream is None:
+            self._stream = self.tokens()
 
-        return Token(TokenType.EOF, '', self.line, self.col)
+        return next(self._stream)
 
 
     def tokenize(self):
-        tokens = []
-
-        token = self.get_next_token()
-        while token.type != TokenType.EOF:
-            tokens.append(token)
-            token = self.get_next_token()
-
-        tokens.append(token)
-
-        return tokens
+        return list(self.tokens())
@@ -10,19 +10,29 @@ from .ast import String, List, Variable, RuleCall, Target
 class Parser:
     def __init__(self,
                  tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.current_token = self.tokens[0]
+        # accepts a token list or a lazy stream such as Lexer.tokens()
+        self.tokens = iter(tokens)
+        self.current_token = next(self.tokens)
+        self.lookahead = None
 
 
     def advance(self):
-        self.pos += 1
-        if self.pos < len(self.tokens):
-            self.current_token = self.tokens[self.pos]
+        if self.lookahead is not None:
+            self.current_token = self.lookahead
+            self.lookahead = None
+        else:
+            self.current_token = next(self.tokens, self.current_token)
 
         return self.current_token
 
 
+    def peek(self):
+        if self.lookahead is None:
+            self.lookahead = next(self.tokens, None)
+
+        return self.lookahead
+
+
     def eat(self,
             token_type):
         if self.current_token.type == token_type:
@@ -53,7 +63,8 @@ class Parser:
             return self.list()
 
         elif token.type == TokenType.IDENTIFIER:
-            if self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1].type == TokenType.LPAREN:
+            next_token = self.peek()
+            if next_token is not None and next_token.type == TokenType.LPAREN:
                 return self.rule_call()
 
             self.advance()
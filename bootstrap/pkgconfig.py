@@ -0,0 +1,214 @@
+import os
+import re
+import shutil
+import marshal
+import threading
+import subprocess as sp
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .fsutil import atomic_write
+
+
+PKGCONFIG_CACHE_VERSION = 1
+
+_REQUIRES_RE = re.compile(r"^Requires(?:\.private)?\s*:(.*)$", re.MULTILINE)
+_OPERATORS = ("<", "<=", "=", "!=", ">=", ">")
+
+
+class PkgConfigError(ValueError):
+    pass
+
+
+def _modules(spec):
+    # "foo >= 1.2, bar" -> ["foo", "bar"]
+    words = [w for w in re.split(r"[\s,]+", spec) if w]
+
+    modules = []
+    skip = False
+    for word in words:
+        if skip:
+            skip = False
+        elif word in _OPERATORS:
+            skip = True
+        else:
+            modules.append(word)
+
+    return modules
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+class PkgConfig:
+    def __init__(self,
+                 cache_path = None,
+                 executable = "pkg-config"):
+        self.cache_path = cache_path
+        self.executable = executable
+
+        # (package, PKG_CONFIG_PATH) -> (((path, mtime_ns), ...), cflags, libs)
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+
+    def _load(self):
+        if self.entries is not None:
+            return
+
+        self.entries = {}
+        if self.cache_path is None:
+            return
+
+        try:
+            with open(self.cache_path, "rb") as fp:
+                version, entries = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+
+        if version == PKGCONFIG_CACHE_VERSION:
+            self.entries = entries
+
+
+    def save(self):
+        if not self.dirty or self.cache_path is None:
+            return
+
+        atomic_write(self.cache_path,
+                     marshal.dumps((PKGCONFIG_CACHE_VERSION, self.entries)))
+        self.dirty = False
+
+
+    def _run(self,
+             *args):
+        result = sp.run([self.executable, *args],
+                        stdout = sp.PIPE,
+                        stderr = sp.PIPE)
+        if result.returncode != 0:
+            raise PkgConfigError(result.stderr.decode("utf-8", "replace").strip()
+                                 or f"{self.executable} exited with code {result.returncode}")
+
+        return result.stdout.decode("utf-8").replace("\n", " ").strip()
+
+
+    def search_path(self):
+        dirs = [d for d in os.environ.get("PKG_CONFIG_PATH", "").split(os.pathsep) if d]
+
+        libdir = os.environ.get("PKG_CONFIG_LIBDIR")
+        if libdir is not None:
+            return dirs + [d for d in libdir.split(os.pathsep) if d]
+
+        # the built-in search path only changes along with the binary
+        binary = shutil.which(self.executable) or self.executable
+        key = ("", "pc_path", binary)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None or entry[0] != ((binary, _mtime(binary)),):
+            entry = (((binary, _mtime(binary)),),
+                     self._run("--variable", "pc_path", "pkg-config"),
+                     "")
+            with self.lock:
+                self.entries[key] = entry
+                self.dirty = True
+
+        return dirs + [d for d in entry[1].split(os.pathsep) if d]
+
+
+    def _stamps(self,
+                package,
+                search_path):
+        # the search directories catch .pc files being added or shadowed,
+        # the .pc files of the package and everything it requires catch edits
+        stamps = [(d, _mtime(d))
+                  for d in search_path]
+
+        pending = _modules(package)
+        seen = set(pending)
+        while pending:
+            module = pending.pop()
+
+            for directory in search_path:
+                pc_file = os.path.join(directory, f"{module}.pc")
+                try:
+                    with open(pc_file, "r") as fp:
+                        content = fp.read()
+                except OSError:
+                    continue
+
+                stamps.append((pc_file, _mtime(pc_file)))
+
+                for requires in _REQUIRES_RE.findall(content):
+                    for dep in _modules(requires):
+                        if dep not in seen:
+                            seen.add(dep)
+                            pending.append(dep)
+
+                break
+
+        return tuple(stamps)
+
+
+    def _resolve_one(self,
+                     package,
+                     search_path):
+        key = (package, os.environ.get("PKG_CONFIG_PATH", ""))
+        stamps = self._stamps(package,
+                              search_path)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is not None and entry[0] == stamps:
+            return entry[1], entry[2]
+
+        cflags = self._run("--cflags", package)
+        libs = self._run("--libs", package)
+
+        with self.lock:
+            self.entries[key] = (stamps, cflags, libs)
+            self.dirty = True
+
+        return cflags, libs
+
+
+    def resolve(self,
+                requests):
+        # requests is a list of (target label, package), returns
+        # package -> (cflags, libs) resolving each package only once
+        self._load()
+
+        packages = {}
+        for label, package in requests:
+            packages.setdefault(package, label)
+
+        try:
+            search_path = self.search_path()
+        except (PkgConfigError, OSError) as err:
+            raise PkgConfigError(f"{requests[0][0]}: pkg-config is unusable: {err}") from None
+
+        results = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers = min(16, len(packages)) or 1) as pool:
+            futures = {package: pool.submit(self._resolve_one, package, search_path)
+                       for package in packages}
+
+            for package, future in futures.items():
+                try:
+                    results[package] = future.result()
+                except (PkgConfigError, OSError) as err:
+                    errors.append(f"{packages[package]}: pkg-config could not resolve '{package}': {err}")
+
+        # whatever did resolve is worth keeping for the next run
+        self.save()
+
+        if errors:
+            raise PkgConfigError("\n".join(errors))
+
+        return results
@@ -0,0 +1,192 @@
+import os
+import json
+import queue
+import shutil
+import threading
+import http.client
+import urllib.parse
+
+
+class RemoteCache:
+    def __init__(self,
+                 url,
+                 timeout = 5.0,
+                 max_connections = 8):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported remote cache url: {url}")
+
+        self.url = url
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+
+        self.connections = queue.LifoQueue(maxsize = max_connections)
+
+        # the first network error disables the remote for the rest of the
+        # build, everything falls back to local compilation
+        self.failed = False
+        self.lock = threading.Lock()
+
+
+    def _connection(self):
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.https:
+            return http.client.HTTPSConnection(self.host,
+                                               self.port,
+                                               timeout = self.timeout)
+
+        return http.client.HTTPConnection(self.host,
+                                          self.port,
+                                          timeout = self.timeout)
+
+
+    def _release(self,
+                 conn):
+        try:
+            self.connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+    def _fail(self,
+              err):
+        with self.lock:
+            if self.failed:
+                return
+
+            self.failed = True
+
+        print(f"WARNING: remote cache {self.url} unavailable, building locally: {err}")
+
+
+    def _request(self,
+                 method,
+                 path,
+                 body = None,
+                 headers = None,
+                 sink = None):
+        if self.failed:
+            return None, None
+
+        conn = self._connection()
+        try:
+            conn.request(method,
+                         self.prefix + path,
+                         body = body,
+                         headers = headers or {})
+            response = conn.getresponse()
+
+            if response.status == 200 and sink is not None:
+                shutil.copyfileobj(response,
+                                   sink,
+                                   1 << 20)
+                data = None
+            else:
+                data = response.read()
+        except (OSError, http.client.HTTPException) as err:
+            conn.close()
+            self._fail(err)
+
+            return None, None
+
+        self._release(conn)
+
+        if response.status >= 500:
+            self._fail(f"{method} {path} returned {response.status}")
+
+        return response.status, data
+
+
+    def find_missing(self,
+                     digests):
+        digests = list(digests)
+        if not digests:
+            return set()
+
+        body = "\n".join(d.hex() for d in digests).encode("ascii")
+        status, data = self._request("POST",
+                                     "/cas/find_missing",
+                                     body = body,
+                                     headers = {"Content-Type": "text/plain"})
+        if status != 200:
+            return set(digests)
+
+        missing = {line.strip()
+                   for line in data.decode("ascii").splitlines()}
+
+        return {d for d in digests if d.hex() in missing}
+
+
+    def download_blob(self,
+                      digest,
+                      dest):
+        tmp_path = f"{dest}.download-{threading.get_ident()}"
+        with open(tmp_path, "wb") as fp:
+            status, _ = self._request("GET",
+                                      f"/cas/{digest.hex()}",
+                                      sink = fp)
+
+        if status != 200:
+            os.unlink(tmp_path)
+            return False
+
+        os.replace(tmp_path,
+                   dest)
+
+        return True
+
+
+    def upload_blob(self,
+                    digest,
+                    path):
+        with open(path, "rb") as fp:
+            status, _ = self._request("PUT",
+                                      f"/cas/{digest.hex()}",
+                                      body = fp,
+                                      headers = {"Content-Length": str(os.fstat(fp.fileno()).st_size),
+                                                 "Content-Type": "application/octet-stream"})
+
+        return status in (200, 201)
+
+
+    def get_manifest(self,
+                     key):
+        status, data = self._request("GET",
+                                     f"/ac/{key.hex()}")
+        if status != 200:
+            return []
+
+        try:
+            entries = json.loads(data)
+
+            return [(tuple((path, bytes.fromhex(digest))
+                           for path, digest in entry["headers"]),
+                     bytes.fromhex(entry["output"]),
+                     bytes.fromhex(entry["depfile"]) if entry["depfile"] else None)
+                    for entry in entries]
+        except (ValueError, KeyError, TypeError):
+            return []
+
+
+    def put_manifest(self,
+                     key,
+                     manifest):
+        body = json.dumps([{"headers": [[path, digest.hex()]
+                                        for path, digest in headers],
+                            "output": output.hex(),
+                            "depfile": depfile.hex() if depfile else None}
+                           for headers, output, depfile in manifest]).encode("utf-8")
+
+        status, _ = self._request("PUT",
+                                  f"/ac/{key.hex()}",
+                                  body = body,
+                                  headers = {"Content-Type": "application/json"})
+
+        return status in (200, 201)
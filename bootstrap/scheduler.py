@@ -0,0 +1,260 @@
+import os
+import time
+import heapq
+import shlex
+import subprocess as sp
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .trace import Tracer
+from .archive import changed_members, break_hardlink, update_command
+
+
+class Action:
+    def __init__(self,
+                 kind,
+                 target,
+                 cmd,
+                 inputs,
+                 output,
+                 depfile = None):
+        self.kind = kind
+        self.target = target
+        self.cmd = cmd
+        self.inputs = inputs
+        self.output = output
+        self.depfile = depfile
+
+        # longest remaining path to a sink, larger values start first
+        self.priority = 0
+
+        # archive members that may be replaced in place, None when the
+        # output is always rebuilt from scratch
+        self.members = None
+
+
+    def __repr__(self):
+        return f'Action("{self.kind}", "{self.target}")'
+
+
+class Scheduler:
+    def __init__(self,
+                 jobs = 1,
+                 state = None,
+                 cache = None,
+                 tracer = None,
+                 keep_going = False,
+                 workers = None):
+        self.jobs = max(1, jobs)
+        self.keep_going = keep_going
+        self.workers = workers
+        self.state = state
+        self.cache = cache if state is not None else None
+        self.tracer = tracer or Tracer(enabled = False)
+        self.started_targets = set()
+        self.sequence = 0
+
+
+    def run(self,
+            dag):
+        in_degree = {node: len(dag.get_dependencies(node))
+                     for node in dag.nodes}
+
+        ready = []
+        for node, degree in in_degree.items():
+            if degree == 0:
+                self._push(ready,
+                           dag,
+                           node)
+
+        running = {}
+        failed = 0
+        completed = 0
+
+        # worker slots double as trace thread ids, 0 is the main thread
+        free_slots = list(range(self.jobs, 0, -1))
+
+        with ThreadPoolExecutor(max_workers = self.jobs) as pool:
+            while ready or running:
+                while ready and (self.keep_going or not failed) and len(running) < self.jobs:
+                    node = heapq.heappop(ready)[2]
+                    action = dag.get_node_data(node)
+
+                    if self.state is not None and self.state.is_up_to_date(action):
+                        completed += 1
+                        self._complete(dag,
+                                       node,
+                                       in_degree,
+                                       ready)
+                        continue
+
+                    self._announce(action)
+
+                    slot = free_slots.pop()
+                    running[pool.submit(self._execute, action, slot)] = node, slot
+
+                if not running:
+                    break
+
+                done, _ = wait(running,
+                               return_when = FIRST_COMPLETED)
+                for future in done:
+                    node, slot = running.pop(future)
+                    free_slots.append(slot)
+                    action = dag.get_node_data(node)
+
+                    returncode, elapsed, cached = future.result()
+                    if returncode != 0:
+                        # dependents keep a non-zero in-degree and never run
+                        print(f"error: {action.kind} of {action.target} failed with exit code {returncode}")
+                        failed += 1
+
+                        if self.state is not None:
+                            self.state.forget(action)
+
+                        continue
+
+                    if self.state is not None:
+                        self.state.record(action,
+                                          None if cached else elapsed)
+
+                    if action.kind == "link":
+                        print(f"[!] done building {action.target}")
+
+                    completed += 1
+                    self._complete(dag,
+                                   node,
+                                   in_degree,
+                                   ready)
+
+        if failed and self.keep_going:
+            skipped = len(in_degree) - completed - failed
+            print(f"[!] {failed} action(s) failed, {skipped} skipped because they depend on a failure")
+        elif failed:
+            print("[!] build stopped after the first failure")
+
+        return not failed
+
+
+    def _complete(self,
+                  dag,
+                  node,
+                  in_degree,
+                  ready):
+        for dependent in dag.get_dependents(node):
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                self._push(ready,
+                           dag,
+                           dependent)
+
+
+    def _push(self,
+              ready,
+              dag,
+              node):
+        self.sequence += 1
+        heapq.heappush(ready,
+                       (-dag.get_node_data(node).priority, self.sequence, node))
+
+
+    def _announce(self,
+                  action):
+        if action.target not in self.started_targets:
+            self.started_targets.add(action.target)
+            print(f"[+] building {action.target} ...")
+
+
+    def _execute(self,
+                 action,
+                 slot = 0):
+        start = time.monotonic()
+
+        if self.cache is not None and self.cache.restore(action, self.state):
+            print(f"\t~> restored from cache: {action.output}\n", end = "")
+
+            end = time.monotonic()
+            self.tracer.add(action.output,
+                            action.kind,
+                            start,
+                            end,
+                            tid = slot,
+                            target = action.target,
+                            exit_code = 0,
+                            cache = "hit")
+
+            return 0, end - start, True
+
+        changed = None
+        if action.members is not None and self.state is not None:
+            changed = changed_members(action,
+                                      self.state)
+
+        if changed is None:
+            print(f"\t~> executing: {action.cmd}\n", end = "")
+
+            # never write through a file that may be hardlinked into the cache
+            if os.path.lexists(action.output):
+                os.unlink(action.output)
+        else:
+            cmd = update_command(action,
+                                 changed)
+            print(f"\t~> updating {len(changed)} of {len(action.members)} members: {cmd}\n", end = "")
+
+            break_hardlink(action.output)
+
+        remote = None
+        if self.workers is not None and action.kind == "compile":
+            remote = self.workers.compile(action)
+
+        if changed is not None:
+            returncode, output, max_rss = _run(cmd) if changed else (0, "", 0)
+        elif remote is None:
+            returncode, output, max_rss = _run(action.cmd)
+        else:
+            returncode, output = remote
+            max_rss = 0
+
+        # one write per action keeps parallel compiler diagnostics apart
+        if output:
+            print(output if output.endswith("\n") else output + "\n", end = "")
+
+        end = time.monotonic()
+        elapsed = end - start
+
+        if returncode == 0 and self.cache is not None:
+            self.cache.store(action,
+                             self.state)
+
+        self.tracer.add(action.output,
+                        action.kind,
+                        start,
+                        end,
+                        tid = slot,
+                        target = action.target,
+                        exit_code = returncode,
+                        cache = "off" if self.cache is None else "miss",
+                        executor = "local" if remote is None else "remote",
+                        peak_rss_kb = max_rss)
+
+        return returncode, elapsed, False
+
+
+def _run(cmd):
+    # runs without a shell, stderr is folded into the captured stdout and
+    # the child is reaped through wait4() to learn its peak resident set
+    try:
+        proc = sp.Popen(shlex.split(cmd),
+                        stdin = sp.DEVNULL,
+                        stdout = sp.PIPE,
+                        stderr = sp.STDOUT)
+    except (OSError, ValueError) as err:
+        return 127, f"error: cannot run `{cmd}`: {err}", 0
+
+    with proc.stdout:
+        output = proc.stdout.read()
+
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return proc.returncode, output.decode("utf-8", "replace"), usage.ru_maxrss
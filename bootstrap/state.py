@@ -0,0 +1,236 @@
+import os
+import marshal
+import hashlib
+import threading
+
+from .depfile import HeaderIndex
+from .fsutil import atomic_write
+
+
+DB_VERSION = 2
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data,
+                           digest_size = 16).digest()
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size = 16)
+
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.digest()
+
+
+class BuildState:
+    def __init__(self,
+                 path):
+        self.path = path
+
+        # path -> id, and per path id the last seen (mtime_ns, size, digest)
+        self.paths = []
+        self.ids = {}
+        self.files = {}
+
+        # output -> (command digest, ((input id, digest), ...), output digest)
+        self.records = {}
+        self.headers = HeaderIndex()
+
+        # output -> seconds its action took the last time it ran
+        self.durations = {}
+
+        # digests already validated during this run, keyed by normalized
+        # path. workers consult them through digest() as well so lookups
+        # are serialized
+        self.current = {}
+        self.lock = threading.RLock()
+
+        # when set, `current` survives between runs and the owner drops
+        # stale entries through invalidate()
+        self.watched = False
+
+        self.load()
+
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as fp:
+                data = marshal.load(fp)
+
+            version = data[0]
+            if version != DB_VERSION:
+                raise ValueError(f"unsupported build database version {version}")
+
+            _, paths, files, records, headers, durations = data
+
+            self.paths = list(paths)
+            self.ids = {path: i
+                        for i, path in enumerate(self.paths)}
+            self.files = files
+            self.records = records
+            self.headers = HeaderIndex.from_dict(headers)
+            self.durations = durations
+        except (OSError, EOFError, ValueError, TypeError):
+            self.paths = []
+            self.ids = {}
+            self.files = {}
+            self.records = {}
+            self.headers = HeaderIndex()
+            self.durations = {}
+
+
+    def save(self):
+        data = (DB_VERSION,
+                self.paths,
+                self.files,
+                self.records,
+                self.headers.to_dict(),
+                self.durations)
+
+        atomic_write(self.path,
+                     marshal.dumps(data))
+
+
+    def _intern(self,
+                path):
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+
+            self.paths.append(path)
+            self.ids[path] = path_id
+
+        return path_id
+
+
+    def digest(self,
+               path):
+        with self.lock:
+            return self._digest(path)
+
+
+    def begin(self):
+        if not self.watched:
+            self.current = {}
+
+
+    def invalidate(self,
+                   path = None):
+        with self.lock:
+            if path is None:
+                self.current = {}
+            else:
+                self.current.pop(os.path.normpath(path), None)
+
+
+    def _digest(self,
+                path):
+        key = os.path.normpath(path)
+        if key in self.current:
+            return self.current[key]
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.current[key] = None
+            return None
+
+        path_id = self._intern(path)
+
+        known = self.files.get(path_id)
+        if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            digest = known[2]
+        else:
+            try:
+                digest = hash_file(path)
+            except OSError:
+                self.current[key] = None
+                return None
+
+            self.files[path_id] = (st.st_mtime_ns, st.st_size, digest)
+
+        self.current[key] = digest
+
+        return digest
+
+
+    def _inputs(self,
+                action):
+        return action.inputs + self.headers.headers(action.output)
+
+
+    def is_up_to_date(self,
+                      action):
+        record = self.records.get(action.output)
+        if record is None:
+            return False
+
+        cmd_digest, inputs, output_digest = record
+        if cmd_digest != hash_bytes(action.cmd.encode("utf-8")):
+            return False
+
+        if self.digest(action.output) != output_digest:
+            return False
+
+        paths = self._inputs(action)
+        if len(paths) != len(inputs):
+            return False
+
+        for path, (path_id, digest) in zip(paths, inputs):
+            if self.ids.get(path) != path_id:
+                return False
+
+            if self.digest(path) != digest:
+                return False
+
+        return True
+
+
+    def record(self,
+               action,
+               elapsed = None):
+        if elapsed is not None:
+            self.durations[action.output] = elapsed
+
+        if action.depfile is not None:
+            self.headers.update(action.output,
+                                action.inputs[0],
+                                action.depfile)
+
+        self.invalidate(action.output)
+        output_digest = self.digest(action.output)
+        if output_digest is None:
+            self.records.pop(action.output, None)
+            return
+
+        inputs = []
+        for path in self._inputs(action):
+            digest = self.digest(path)
+            if digest is None:
+                self.records.pop(action.output, None)
+                return
+
+            # the same file may have been digested under another spelling
+            with self.lock:
+                inputs.append((self._intern(path), digest))
+
+        self.records[action.output] = (hash_bytes(action.cmd.encode("utf-8")),
+                                       tuple(inputs),
+                                       output_digest)
+
+
+    def forget(self,
+               action):
+        self.records.pop(action.output, None)
+        self.headers.forget(action.output)
+        self.invalidate(action.output)
+
+
+    def mean_duration(self):
+        if not self.durations:
+            return None
+
+        return sum(self.durations.values()) / len(self.durations)
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+
+class Tracer:
+    # collects Chrome trace format events (chrome://tracing, ui.perfetto.dev)
+
+    def __init__(self,
+                 enabled = True):
+        self.enabled = enabled
+        self.origin = time.monotonic()
+        self.events = []
+        self.lock = threading.Lock()
+
+
+    def now(self):
+        return time.monotonic()
+
+
+    def add(self,
+            name,
+            category,
+            start,
+            end,
+            tid = 0,
+            **args):
+        if not self.enabled:
+            return
+
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "X",
+                 "ts": round((start - self.origin) * 1e6),
+                 "dur": round((end - start) * 1e6),
+                 "pid": os.getpid(),
+                 "tid": tid}
+        if args:
+            event["args"] = args
+
+        with self.lock:
+            self.events.append(event)
+
+
+    @contextlib.contextmanager
+    def span(self,
+             name,
+             category = "phase",
+             **args):
+        if not self.enabled:
+            yield
+            return
+
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name,
+                     category,
+                     start,
+                     self.now(),
+                     **args)
+
+
+    def save(self,
+             path):
+        pid = os.getpid()
+
+        with self.lock:
+            events = list(self.events)
+
+        slots = sorted({e["tid"] for e in events})
+        metadata = [{"name": "thread_name",
+                     "ph": "M",
+                     "pid": pid,
+                     "tid": tid,
+                     "args": {"name": "main" if tid == 0 else f"worker {tid}"}}
+                    for tid in slots]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory,
+                        exist_ok = True)
+
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": metadata + events,
+                       "displayTimeUnit": "ms"},
+                      fp)
@@ -0,0 +1,66 @@
+import os
+import hashlib
+
+from .fsutil import atomic_write
+
+
+def _path_hash(path):
+    return hashlib.blake2b(path.encode("utf-8"),
+                           digest_size = 8).digest()
+
+
+def unity_batches(sources,
+                  batch_size):
+    # batch boundaries are picked from the hashes of the paths themselves
+    # (content defined chunking), so adding or removing a source only
+    # reshapes the batch it lands in instead of shifting every later one
+    batches = []
+    current = []
+
+    for source in sorted(sources):
+        current.append(source)
+
+        cut = int.from_bytes(_path_hash(source)[:4], "big") % batch_size == 0
+        if cut or len(current) >= 2 * batch_size:
+            batches.append(current)
+            current = []
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def unity_name(batch):
+    # named after the first member, which only changes when the batch does
+    return f"unity_{_path_hash(batch[0]).hex()[:8]}"
+
+
+def include_content(path,
+                    members):
+    directory = os.path.dirname(path)
+
+    lines = ["// generated by xenbuild, do not edit"]
+    for member in members:
+        lines.append(f'#include "{os.path.relpath(member, directory)}"')
+
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def write_include_file(path,
+                       members):
+    # a generated file that #includes each member, rewritten only when
+    # membership changes so it keeps its mtime and digest otherwise
+    content = include_content(path,
+                              members)
+    try:
+        with open(path, "rb") as fp:
+            if fp.read() == content:
+                return False
+    except OSError:
+        pass
+
+    atomic_write(path,
+                 content)
+
+    return True
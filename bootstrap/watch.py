@@ -0,0 +1,122 @@
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self,
+                 ignore = (".git",)):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name,
+                                use_errno = True)
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+
+        self.ignore = set(ignore)
+        self.watches = {}
+
+        # false once a watch could not be added, callers should stop
+        # trusting the event stream and rescan instead
+        self.complete = True
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+    def watch_tree(self,
+                   root):
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            self._add_watch(directory)
+
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks = False) and entry.name not in self.ignore:
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+
+    def _add_watch(self,
+                   directory):
+        wd = self.libc.inotify_add_watch(self.fd,
+                                         os.fsencode(directory),
+                                         WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err != errno.ENOENT:
+                self.complete = False
+
+            return
+
+        self.watches[wd] = directory
+
+
+    def read_events(self):
+        # yields (path, mask) for every queued event, newly created
+        # directories are watched before their event is reported
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.complete = False
+                    yield None, mask
+
+                    continue
+
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    continue
+
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and os.path.basename(path) not in self.ignore:
+                    self.watch_tree(path)
+
+                yield path, mask
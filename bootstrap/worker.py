@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import struct
+import shutil
+import argparse
+import tempfile
+import threading
+import socketserver
+import subprocess as sp
+
+
+# every message is a 4 byte header length, a json header, then `size`
+# bytes of payload
+_LENGTH = struct.Struct("!I")
+
+DEFAULT_PORT = 8091
+
+DEFAULT_COMPILERS = ("c++", "g++", "gcc", "cc", "clang", "clang++")
+
+# a compile of preprocessed source never needs more than these, anything
+# that loads plugins, runs other programs or writes elsewhere is refused
+_SAFE_FLAGS = ("-c", "-w", "-pipe", "-pedantic", "-pedantic-errors", "-pthread",
+               "-fPIC", "-fpic", "-fPIE", "-fpie", "-fno-plt", "-fno-common",
+               "-fexceptions", "-fno-exceptions", "-frtti", "-fno-rtti",
+               "-fomit-frame-pointer", "-fno-omit-frame-pointer",
+               "-fstrict-aliasing", "-fno-strict-aliasing", "-fwrapv", "-ffast-math",
+               "-ffunction-sections", "-fdata-sections", "-funroll-loops",
+               "-fstack-protector", "-fstack-protector-strong", "-fstack-protector-all",
+               "-fno-stack-protector", "-fno-builtin", "-fno-inline",
+               "-fdiagnostics-color", "-fcolor-diagnostics", "-m32", "-m64")
+_SAFE_PREFIXES = ("-std=", "-O", "-g", "-D", "-U", "-I", "-W",
+                  "-fvisibility=", "-fdiagnostics-color=", "-ftemplate-depth=",
+                  "-march=", "-mtune=", "-mcpu=")
+_UNSAFE_PREFIXES = ("-Wl,", "-Wa,", "-Wp,")
+
+
+def send_message(sock,
+                 header,
+                 payload = b""):
+    header = dict(header,
+                  size = len(payload))
+    data = json.dumps(header).encode("utf-8")
+
+    sock.sendall(_LENGTH.pack(len(data)) + data + payload)
+
+
+def _recv_exactly(sock,
+                  size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed mid-message")
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    # returns (header, payload), or (None, None) on a clean close
+    first = sock.recv(_LENGTH.size)
+    if not first:
+        return None, None
+
+    if len(first) < _LENGTH.size:
+        first += _recv_exactly(sock, _LENGTH.size - len(first))
+
+    header = json.loads(_recv_exactly(sock, _LENGTH.unpack(first)[0]))
+    payload = _recv_exactly(sock, header.get("size", 0))
+
+    return header, payload
+
+
+def _plain_name(name):
+    return isinstance(name, str) and name not in ("", ".", "..") and os.path.basename(name) == name
+
+
+def unsafe_argument(header):
+    # the first argument a compile request may not run with, or None
+    argv = header.get("argv")
+    if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+        return "argv"
+
+    for key in ("input", "output"):
+        if not _plain_name(header.get(key)):
+            return f"{key} {header.get(key)!r}"
+
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-o":
+            if i + 1 >= len(argv) or argv[i + 1] != header["output"]:
+                return arg
+
+            i += 2
+            continue
+
+        if arg == header["input"] or arg in _SAFE_FLAGS:
+            pass
+        elif not arg.startswith(_SAFE_PREFIXES) or arg.startswith(_UNSAFE_PREFIXES):
+            return arg
+
+        i += 1
+
+    return None
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # connections are kept open and serve requests until the client
+        # closes them
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+
+            if header is None:
+                return
+
+            op = header.get("op")
+            if op == "status":
+                send_message(self.request,
+                             {"jobs": self.server.jobs,
+                              "load": self.server.load})
+            elif op == "compile":
+                reply, obj = self.server.compile(header,
+                                                 payload)
+                send_message(self.request,
+                             reply,
+                             obj)
+            else:
+                send_message(self.request,
+                             {"error": f"unknown op {op}"})
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self,
+                 address,
+                 jobs = None,
+                 compilers = DEFAULT_COMPILERS,
+                 verbose = False):
+        super().__init__(address,
+                         WorkerHandler)
+
+        self.jobs = jobs or os.cpu_count() or 1
+        self.compilers = set(compilers)
+        self.verbose = verbose
+
+        self.slots = threading.BoundedSemaphore(self.jobs)
+        self.load = 0
+        self.lock = threading.Lock()
+
+
+    def compile(self,
+                header,
+                source):
+        # policy refusals are marked so clients compile that one action
+        # locally instead of giving up on the worker
+        unsafe = unsafe_argument(header)
+        if unsafe is not None:
+            return {"error": f"refusing to compile with {unsafe}", "refused": True, "load": self.load}, b""
+
+        # only compilers found on the worker's own PATH, never a client path
+        argv = header["argv"]
+        executable = None
+        if argv and os.sep not in argv[0] and not (os.altsep and os.altsep in argv[0]) and argv[0] in self.compilers:
+            executable = shutil.which(argv[0])
+
+        if executable is None:
+            return {"error": f"compiler {argv[0] if argv else ''} not allowed on this worker", "refused": True, "load": self.load}, b""
+
+        argv = [executable] + argv[1:]
+
+        with self.lock:
+            self.load += 1
+
+        try:
+            with self.slots, tempfile.TemporaryDirectory(prefix = "xenbuild-worker-") as tmp:
+                with open(os.path.join(tmp, header["input"]), "wb") as fp:
+                    fp.write(source)
+
+                if self.verbose:
+                    print(f"[+] {' '.join(argv)}")
+                    sys.stdout.flush()
+
+                result = sp.run(argv,
+                                cwd = tmp,
+                                stdin = sp.DEVNULL,
+                                stdout = sp.PIPE,
+                                stderr = sp.STDOUT)
+
+                obj = b""
+                if result.returncode == 0:
+                    with open(os.path.join(tmp, header["output"]), "rb") as fp:
+                        obj = fp.read()
+        except OSError as err:
+            return {"error": str(err), "load": self.load}, b""
+        finally:
+            with self.lock:
+                self.load -= 1
+
+        return {"returncode": result.returncode,
+                "output": result.stdout.decode("utf-8", "replace"),
+                "load": self.load}, obj
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "xenbuild distributed compile worker")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT)
+    parser.add_argument("-j", "--jobs", type = int, default = None)
+    parser.add_argument("--allow", action = "append", default = None,
+                        help = "compiler executable names the worker may run")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args(argv)
+
+    if not any(shutil.which(c) for c in args.allow or DEFAULT_COMPILERS):
+        print("WARNING: none of the allowed compilers are on PATH")
+
+    server = WorkerServer((args.host, args.port),
+                          args.jobs,
+                          args.allow or DEFAULT_COMPILERS,
+                          args.verbose)
+    print(f"[!] xenbuild worker serving {server.jobs} jobs on {args.host}:{server.server_address[1]}")
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
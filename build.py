@@ -1,43 +1,185 @@
 import os
 import sys
 
-from bootstrap.builder import Builder
+from bootstrap import client
+
+
+_VALUE_OPTIONS = {
+    "-j": "jobs",
+    "--jobs": "jobs",
+    "--cache-dir": "cache_dir",
+    "--cache-size": "cache_size",
+    "--remote-cache": "remote_cache",
+    "--trace": "trace",
+    "--workers": "workers",
+    "--unity": "unity",
+    "--archive": "archive",
+}
+
+_FLAG_OPTIONS = {
+    "--no-cache": "no_cache",
+    "--no-server": "no_server",
+    "-k": "keep_going",
+    "--keep-going": "keep_going",
+}
+
+
+# options that shape the server's builder rather than a single build
+_SERVER_OPTIONS = ("cache_dir", "cache_size", "no_cache", "remote_cache", "workers", "unity", "archive")
+
+
+def _default_options():
+    return {
+        "jobs": None,
+        "cache_dir": None,
+        "cache_size": "10G",
+        "no_cache": False,
+        "remote_cache": os.environ.get("XENBUILD_REMOTE_CACHE"),
+        "no_server": False,
+        "trace": None,
+        "keep_going": False,
+        "workers": os.environ.get("XENBUILD_WORKERS"),
+        "unity": 0,
+        "archive": "full",
+    }
+
+
+def _parse_options(cmd):
+    args = []
+    options = _default_options()
+
+    # names of the options given on the command line
+    explicit = set()
+
+    i = 0
+    while i < len(cmd):
+        arg = cmd[i]
+
+        if arg in _VALUE_OPTIONS:
+            if i + 1 >= len(cmd):
+                raise ValueError(f"{arg} requires a value")
+
+            options[_VALUE_OPTIONS[arg]] = cmd[i + 1]
+            explicit.add(_VALUE_OPTIONS[arg])
+            i += 2
+
+            continue
+
+        if arg in _FLAG_OPTIONS:
+            options[_FLAG_OPTIONS[arg]] = True
+            explicit.add(_FLAG_OPTIONS[arg])
+        elif arg.startswith("-j"):
+            options["jobs"] = arg[2:]
+            explicit.add("jobs")
+        else:
+            args.append(arg)
+
+        i += 1
+
+    if options["jobs"] is not None:
+        options["jobs"] = int(options["jobs"])
+
+    options["unity"] = int(options["unity"])
+    options["explicit"] = explicit
+
+    return args, options
+
+
+def _make_builder(options,
+                  debug):
+    # imported here so that handing a build to a running server stays cheap
+    from bootstrap.builder import Builder
+    from bootstrap.daemon import builder_options
+
+    return Builder(".",
+                   debug = debug,
+                   jobs = options["jobs"],
+                   keep_going = options["keep_going"],
+                   **builder_options(options))
 
 
 def _build(cmd,
-           builder):
-    if len(cmd) <= 2:
-        dag = builder.build_dependency_graph()
-        build_order = dag.topological_sort()
+           options,
+           debug):
+    target_names = cmd[2:] if len(cmd) > 2 else None
+
+    if not options["no_server"]:
+        # everything set explicitly, even to a default value, the rest
+        # keeps the values the server was started with
+        overrides = {k: options[k]
+                     for k in _SERVER_OPTIONS
+                     if k in options["explicit"]}
+        if overrides.get("cache_dir") is not None:
+            overrides["cache_dir"] = os.path.abspath(overrides["cache_dir"])
 
-        for target_name in build_order:
-            builder.build_target(target_name)
+        status = client.request(".",
+                                {"command": "build",
+                                 "debug": debug,
+                                 "targets": target_names,
+                                 "jobs": options["jobs"],
+                                 "keep_going": options["keep_going"],
+                                 "options": overrides,
+                                 "trace": options["trace"] and os.path.abspath(options["trace"])})
+        if status is not None:
+            sys.exit(status)
 
-        return
+    builder = _make_builder(options,
+                            debug)
 
-    target_name = cmd[2]
-    builder.build_target(target_name)
+    if options["trace"] is None:
+        ok = builder.build_targets(target_names)
+    else:
+        from bootstrap.trace import Tracer
+
+        builder.tracer = Tracer()
+        try:
+            ok = builder.build_targets(target_names)
+        finally:
+            builder.tracer.save(options["trace"])
+            print(f"[!] trace written to {options['trace']}")
+
+    if not ok:
+        sys.exit(1)
 
 
 def build(cmd):
-    builder = Builder(".",
-                      debug = True)
+    cmd, options = _parse_options(cmd)
 
     _build(cmd,
-           builder)
+           options,
+           debug = True)
 
 
 def build_release(cmd):
-    builder = Builder(".",
-                      debug = False)
+    cmd, options = _parse_options(cmd)
 
     _build(cmd,
-           builder)
+           options,
+           debug = False)
+
+
+def server(cmd):
+    if len(cmd) <= 2 or cmd[2] not in ("start", "stop", "status"):
+        print("USAGE:\n  %s server start|stop|status [options]" % cmd[0])
+        sys.exit(1)
+
+    if cmd[2] == "start":
+        sys.exit(client.start(".",
+                              cmd[3:]))
+
+    status = client.request(".",
+                            {"command": "shutdown" if cmd[2] == "stop" else "status"})
+    if status is None:
+        print("[!] no xenbuild server is running")
+        sys.exit(1 if cmd[2] == "status" else 0)
+
+    sys.exit(status)
 
 
 def graph(cmd):
-    builder = Builder(".",
-                      debug = True)
+    cmd, options = _parse_options(cmd)
+    builder = _make_builder(options,
+                            debug = True)
 
     os.makedirs("build",
                 exist_ok = True)
@@ -48,10 +190,152 @@ def graph(cmd):
     print("[!] dependency graph rendered to build/dependency_graph.pdf")
 
 
+def profile(cmd):
+    cmd, options = _parse_options(cmd)
+    builder = _make_builder(options,
+                            debug = True)
+
+    target_names = cmd[2:] if len(cmd) > 2 else None
+    if target_names is None:
+        dag = builder.build_dependency_graph()
+    else:
+        dag = builder.load_packages(target_names)
+
+    required = builder.required_targets(dag,
+                                        target_names)
+
+    state = builder.build_state()
+    if not state.durations:
+        print("[!] no recorded action times yet, run a build first")
+        sys.exit(1)
+
+    durations = builder.target_durations(required,
+                                         state)
+
+    print("[!] slowest targets (seconds spent in their actions):")
+    for target_name in sorted(durations, key = durations.get, reverse = True)[:10]:
+        print(f"\t{durations[target_name]:8.2f}s  {target_name}")
+
+    path = dag.critical_path(durations)
+    print(f"[!] critical path ({sum(durations[t] for t in path):.2f}s):")
+    for target_name in path:
+        print(f"\t{durations[target_name]:8.2f}s  {target_name}")
+
+
+def compdb(cmd):
+    import json
+    import tempfile
+
+    cmd, options = _parse_options(cmd)
+    builder = _make_builder(options,
+                            debug = True)
+
+    target_names = cmd[2:] if len(cmd) > 2 else None
+    if target_names is None:
+        dag = builder.build_dependency_graph()
+    else:
+        dag = builder.load_packages(target_names)
+
+    # streamed into a temporary file so editors never see a partial database
+    fd, tmp_path = tempfile.mkstemp(prefix = ".compile_commands.json-",
+                                    dir = ".")
+    os.fchmod(fd,
+              0o644)
+
+    count = 0
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write("[")
+            for entry in builder.compile_commands(sorted(builder.required_targets(dag, target_names))):
+                fp.write(",\n" if count else "\n")
+                fp.write(json.dumps(entry))
+                count += 1
+            fp.write("\n]\n")
+
+        os.replace(tmp_path,
+                   "compile_commands.json")
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    print(f"[!] wrote {count} entries to compile_commands.json")
+
+
+def query(cmd):
+    cmd, options = _parse_options(cmd)
+
+    kinds = {"deps": 1, "rdeps": None, "somepath": 2, "allpaths": 2}
+    if len(cmd) <= 3 or cmd[2] not in kinds or kinds[cmd[2]] not in (None, len(cmd) - 3):
+        print("USAGE:\n  %s query deps LABEL | rdeps LABEL|FILE... | somepath FROM TO | allpaths FROM TO" % cmd[0])
+        sys.exit(1)
+
+    builder = _make_builder(options,
+                            debug = True)
+    dag = builder.build_dependency_graph()
+
+    kind, operands = cmd[2], cmd[3:]
+
+    if kind == "rdeps":
+        labels = set()
+        for operand in operands:
+            if operand in dag.nodes:
+                labels.add(operand)
+                continue
+
+            owners = builder.owning_targets([operand])
+            if not owners:
+                if operand.startswith("@/"):
+                    print(f"error: unknown target: {operand}")
+                else:
+                    print(f"error: unknown target, no target owns {operand}")
+                sys.exit(1)
+
+            labels |= owners
+
+        result = dag.reachable(labels)
+    else:
+        for label in operands:
+            if label not in dag.nodes:
+                print(f"error: unknown target: {label}")
+                sys.exit(1)
+
+        if kind == "deps":
+            result = dag.reachable(operands,
+                                   reverse = True)
+        elif kind == "somepath":
+            # FROM depends on TO, so the path runs against the edges
+            path = dag.find_path(operands[1],
+                                 operands[0])
+            if path is None:
+                print(f"[!] {operands[0]} does not depend on {operands[1]}")
+                sys.exit(1)
+
+            for label in reversed(path):
+                print(label)
+
+            return
+        else:
+            result = dag.reachable([operands[0]], reverse = True) & dag.reachable([operands[1]])
+
+    for label in sorted(result):
+        print(label)
+
+
 if __name__ == "__main__":
     if len(sys.argv) <= 1:
-        print("USAGE:\n  %s command\nWHERE" % sys.argv[0])
-        print("  command\t\t`build` or `graph`")
+        print("USAGE:\n  %s command [options] [target...]\nWHERE" % sys.argv[0])
+        print("  command\t\t`build`, `build-release`, `graph`, `profile`, `compdb`, `query` or `server start|stop|status`")
+        print("  -j, --jobs N\t\tnumber of parallel jobs (defaults to the CPU count)")
+        print("  --cache-dir DIR\taction cache directory (defaults to $XENBUILD_CACHE_DIR or ~/.cache/xenbuild)")
+        print("  --cache-size SIZE\taction cache size cap, e.g. 512M or 10G (defaults to 10G)")
+        print("  --no-cache\t\tdisable the action cache")
+        print("  --remote-cache URL\tshared http cache consulted on local misses (defaults to $XENBUILD_REMOTE_CACHE)")
+        print("  --workers HOSTS\tcomma separated host:port compile workers (defaults to $XENBUILD_WORKERS)")
+        print("  --unity N\t\tcompile targets without a `unity` attribute in batches of about N sources")
+        print("  --archive MODE\t`full` (default), `incremental` to replace only changed members, or `thin`")
+        print("  -k, --keep-going\tkeep building everything that does not depend on a failed action")
+        print("  --no-server\t\tbuild in this process even if a xenbuild server is running")
+        print("  --trace FILE\t\twrite a Chrome trace (chrome://tracing, ui.perfetto.dev) of the build")
 
         sys.exit(1)
 
@@ -59,6 +343,10 @@ if __name__ == "__main__":
         "build": build,
         "build-release": build_release,
         "graph": graph,
+        "profile": profile,
+        "compdb": compdb,
+        "query": query,
+        "server": server,
     }[sys.argv[1]](sys.argv)
 
     sys.exit(0)
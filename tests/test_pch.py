@@ -0,0 +1,79 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess as sp
+
+
+BUILD_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "build.py")
+
+
+@unittest.skipIf(shutil.which("c++") is None, "needs a c++ compiler")
+class RestoredPchTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix = "xenbuild-pch-")
+        self.env = dict(os.environ,
+                        XENBUILD_CACHE_DIR = os.path.join(self.root, ".cache"))
+
+        self.write("app/BUILD",
+                   'cc_binary(name = "app", sources = ["main.cc"], includes = ["include"], pch = "include/pch.hh")\n')
+        self.write("app/include/pch.hh",
+                   "#pragma once\n#include <cstdio>\ninline int answer() { return 42; }\n")
+        self.write("app/main.cc",
+                   'int main() { std::printf("%d\\n", answer()); }\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root,
+                      ignore_errors = True)
+
+
+    def write(self,
+              path,
+              content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path),
+                    exist_ok = True)
+
+        with open(path, "w") as fp:
+            fp.write(content)
+
+
+    def build(self):
+        result = sp.run([sys.executable, BUILD_PY, "build", "--no-server"],
+                        cwd = self.root,
+                        env = self.env,
+                        stdout = sp.PIPE,
+                        stderr = sp.STDOUT)
+        output = result.stdout.decode("utf-8", "replace")
+        self.assertEqual(result.returncode, 0, output)
+
+        return output
+
+
+    def test_compile_with_restored_pch(self):
+        self.build()
+
+        # a fresh checkout: same header contents with a new mtime, the
+        # precompiled header comes back from the action cache while the
+        # changed source has to compile against it
+        shutil.rmtree(os.path.join(self.root, "build"))
+        header = os.path.join(self.root, "app/include/pch.hh")
+        st = os.stat(header)
+        os.utime(header,
+                 (st.st_atime + 3600, st.st_mtime + 3600))
+        self.write("app/main.cc",
+                   'int main() { std::printf("%d\\n", answer() + 1); }\n')
+
+        output = self.build()
+        self.assertRegex(output, r"restored from cache: \S+\.(pch|gch)")
+
+        result = sp.run([os.path.join(self.root, "build/bin/app")],
+                        stdout = sp.PIPE)
+        self.assertEqual(result.stdout, b"43\n")
+
+
+if __name__ == "__main__":
+    unittest.main()